@@ -15,6 +15,8 @@ CONVERTED_DIR = os.path.join(BASE_DIR, "converted_images")
 # Configuração de APIs
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
 
 # Configurações de aplicação
 APP_TITLE = "Extrator de Documentos com IA"
@@ -27,6 +29,9 @@ CLEANUP_INTERVAL_HOURS = int(os.getenv("CLEANUP_INTERVAL_HOURS", "6"))
 TEMP_RETENTION_HOURS = int(os.getenv("TEMP_RETENTION_HOURS", "24"))
 RESULTS_RETENTION_HOURS = int(os.getenv("RESULTS_RETENTION_HOURS", "72"))
 
+# Resultados JSON indentados (legíveis) ou compactos
+PRETTY_RESULTS_JSON = os.getenv("PRETTY_RESULTS_JSON", "false").lower() == "true"
+
 # Configurações de logging
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_LEVEL = "INFO"
@@ -1,4 +1,5 @@
 # app/data/reference_data.py
+from functools import lru_cache
 
 # Mapeamento de códigos de cor para nomes de cor
 COLOR_MAP = {
@@ -177,6 +178,7 @@ WOMEN_ONLY_BRANDS = [
     "LEBEK FASHION"
 ]
 
+@lru_cache(maxsize=256)
 def determine_gender_by_brand(brand: str) -> str:
 
     if not brand:
@@ -201,6 +203,11 @@ SUPPLIER_MAP = {k: v["nome"] for k, v in SUPPLIER_DATA.items()}
 SUPPLIER_CODE_MAP = {v: k for k, v in SUPPLIER_MAP.items()}
 MARKUP_MAP = {k: v["marcacao"] for k, v in SUPPLIER_DATA.items() if v["marcacao"] is not None}
 
+# Nomes já em maiúsculas para as buscas parciais (mantêm a ordem original dos mapas)
+_COLOR_NAMES_UPPER = tuple((name.upper(), code) for name, code in COLOR_CODE_MAP.items())
+_SUPPLIER_NAMES_UPPER = tuple((name.upper(), code) for name, code in SUPPLIER_CODE_MAP.items())
+_SIZE_MAP_UPPER = {size.upper(): code for size, code in reversed(SIZE_MAP.items())}
+
 def get_color_name(color_code):
     """
     Retorna o nome da cor baseado no código
@@ -231,8 +238,8 @@ def get_color_code(color_name):
         return COLOR_CODE_MAP[color_name]
     
     # Busca por correspondência parcial
-    for name, code in COLOR_CODE_MAP.items():
-        if name.upper() in color_name_upper or color_name_upper in name.upper():
+    for name_upper, code in _COLOR_NAMES_UPPER:
+        if name_upper in color_name_upper or color_name_upper in name_upper:
             return code
     
     return None
@@ -251,13 +258,10 @@ def get_size_code(size):
     if size_upper in SIZE_MAP:
         return SIZE_MAP[size_upper]
     
-    # Busca por correspondência parcial
-    for s, code in SIZE_MAP.items():
-        if s.upper() == size_upper:
-            return code
-    
-    return None
+    # Busca sem distinção de maiúsculas
+    return _SIZE_MAP_UPPER.get(size_upper)
 
+@lru_cache(maxsize=256)
 def get_category(category_name):
     """
     Verifica se uma categoria existe e retorna-a padronizada
@@ -280,6 +284,7 @@ def get_category(category_name):
     
     return None
 
+@lru_cache(maxsize=256)
 def get_supplier_code(supplier_name):
     """
     Retorna o código do fornecedor baseado no nome
@@ -297,8 +302,8 @@ def get_supplier_code(supplier_name):
         return SUPPLIER_CODE_MAP[supplier_name]
     
     # Busca parcial
-    for name, code in SUPPLIER_CODE_MAP.items():
-        if name.upper() in supplier_upper or supplier_upper in name.upper():
+    for name_upper, code in _SUPPLIER_NAMES_UPPER:
+        if name_upper in supplier_upper or supplier_upper in name_upper:
             return code
     
     return None
@@ -320,6 +325,7 @@ def get_supplier_by_code(code):
     
     return None
 
+@lru_cache(maxsize=256)
 def get_markup(supplier_code):
     """
     Retorna o valor de marcação (margem) para um fornecedor
@@ -18,6 +18,9 @@ class ColorMappingAgent:
         self.model = genai.GenerativeModel(GEMINI_MODEL)
         self.color_map = COLOR_MAP
         
+        # Mapeamentos resolvidos pelo Gemini por nome de cor (cada nome resolvido só vai uma vez ao Gemini)
+        self._name_mapping_cache: Dict[str, Dict[str, str]] = {}
+        
         # Estatísticas para logging
         self.stats = {
             "total_colors_processed": 0,
@@ -60,7 +63,7 @@ class ColorMappingAgent:
                     
                     # Mapear color_name na referência se necessário
                     if "color_name" in ref and ref["color_name"]:
-                        mapped_color_info = self._map_color_name_with_ai(ref["color_name"])
+                        mapped_color_info = self._lookup_color_name(ref["color_name"])
                         
                         if mapped_color_info:
                             mapped_ref["color_name"] = mapped_color_info["name"]
@@ -86,7 +89,7 @@ class ColorMappingAgent:
         original_code = color.get("color_code", "")
         
         if original_name:
-            mapped_info = self._map_color_name_with_ai(original_name)
+            mapped_info = self._lookup_color_name(original_name)
             
             if mapped_info:
                 # Verificar se o código original estava correto
@@ -127,6 +130,26 @@ class ColorMappingAgent:
         
         return mapped_color
     
+    def _lookup_color_name(self, color_name: str) -> Optional[Dict[str, str]]:
+        """Mapeia um nome de cor, reutilizando o resultado de nomes já vistos"""
+        if color_name in self._name_mapping_cache:
+            return self._name_mapping_cache[color_name]
+        
+        mapped_info = self._map_color_name_with_ai(color_name)
+        if mapped_info:
+            # Só resoluções válidas do Gemini vão para a cache; falhas voltam a ser tentadas
+            self._name_mapping_cache[color_name] = mapped_info
+            return mapped_info
+        
+        if not color_name or not color_name.strip():
+            return None
+        
+        # Fallback inteligente (não guardado na cache)
+        fallback_mapping = self._get_fallback_mapping(color_name)
+        if fallback_mapping:
+            logger.info(f"Usado mapeamento de fallback para '{color_name}' → {fallback_mapping['name']} ({fallback_mapping['code']})")
+        return fallback_mapping
+    
     def _map_color_name_with_ai(self, color_name: str) -> Optional[Dict[str, str]]:
         if not color_name or not color_name.strip():
             return None
@@ -202,34 +225,14 @@ class ColorMappingAgent:
                 return mapping_info
             else:
                 logger.warning(f"Resposta inválida do Gemini para cor '{color_name}': {response_text[:100]}...")
-                
-                # Fallback inteligente
-                fallback_mapping = self._get_fallback_mapping(color_name)
-                if fallback_mapping:
-                    logger.info(f"Usado mapeamento de fallback para '{color_name}' → {fallback_mapping['name']} ({fallback_mapping['code']})")
-                    return fallback_mapping
-                
                 return None
                     
         except Exception as e:
             logger.error(f"Erro ao mapear cor '{color_name}' com IA: {str(e)}")
-            
-            # Fallback em caso de erro
-            fallback_mapping = self._get_fallback_mapping(color_name)
-            if fallback_mapping:
-                logger.info(f"Usado mapeamento de fallback para '{color_name}' → {fallback_mapping['name']} ({fallback_mapping['code']})")
-                return fallback_mapping
-            
             return None
                     
         except Exception as e:
             logger.error(f"Erro ao mapear cor '{color_name}' com IA: {str(e)}")
-            
-            fallback_mapping = self._get_fallback_mapping(color_name)
-            if fallback_mapping:
-                logger.info(f"Usado mapeamento de fallback para '{color_name}' → {fallback_mapping['name']} ({fallback_mapping['code']})")
-                return fallback_mapping
-            
             return None
 
     def _get_fallback_mapping(self, color_name: str) -> Optional[Dict[str, str]]:
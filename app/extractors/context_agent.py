@@ -1,5 +1,6 @@
 # app/extractors/context_agent.py
 import os
+import asyncio
 import json
 import logging
 import re
@@ -9,7 +10,7 @@ from PIL import Image
 import fitz
 
 from app.config import GEMINI_API_KEY, GEMINI_MODEL, CONVERTED_DIR
-from app.utils.file_utils import convert_pdf_to_images, extract_text_from_pdf, optimize_image
+from app.utils.file_utils import MUPDF_LOCK, convert_pdf_to_images, extract_text_from_pdf, optimize_image
 from app.data.reference_data import get_supplier_code, SUPPLIER_MAP
 from app.utils.supplier_utils import match_supplier_name, normalize_supplier_name, get_normalized_supplier
 
@@ -21,7 +22,7 @@ class ContextAgent:
         genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel(GEMINI_MODEL)
     
-    async def analyze_document(self, document_path: str) -> Dict[str, Any]:   
+    async def analyze_document(self, document_path: str, first_page_path: Optional[str] = None) -> Dict[str, Any]:   
         filename = os.path.basename(document_path)
         fallback_info = {
             "document_type": "Documento de pedido",
@@ -53,7 +54,7 @@ class ContextAgent:
             doc_structure = self._analyze_pdf_structure(document_path)
             
             # Preparar imagem da primeira página para análise visual
-            first_page_image = await self._prepare_first_page_image(document_path)
+            first_page_image = await self._prepare_first_page_image(document_path, first_page_path)
             
             if first_page_image:
                 # Realizar análise completa com texto e imagem
@@ -80,7 +81,8 @@ class ContextAgent:
             
         except Exception as e:
             logger.exception(f"Erro na análise de contexto avançada: {str(e)}")
-            return self._ensure_supplier_and_brand(fallback_info)
+            # Marcado como fallback para não ser reutilizado como análise válida
+            return self._ensure_supplier_and_brand({**fallback_info, "_fallback": True})
     
     def _analyze_pdf_structure(self, pdf_path: str) -> Dict[str, Any]:
         """
@@ -102,51 +104,52 @@ class ContextAgent:
             }
             
             # Abrir o documento PDF
-            pdf_document = fitz.open(pdf_path)
-            structure_info["page_count"] = len(pdf_document)
+            with MUPDF_LOCK:
+                pdf_document = fitz.open(pdf_path)
+                structure_info["page_count"] = len(pdf_document)
             
-            # Analisar apenas as primeiras 2 páginas para entender a estrutura
-            pages_to_analyze = min(2, len(pdf_document))
+                # Analisar apenas as primeiras 2 páginas para entender a estrutura
+                pages_to_analyze = min(2, len(pdf_document))
             
-            for page_num in range(pages_to_analyze):
-                page = pdf_document.load_page(page_num)
+                for page_num in range(pages_to_analyze):
+                    page = pdf_document.load_page(page_num)
                 
-                # Extrair blocos de texto
-                blocks = page.get_text("blocks")
-                structure_info["text_blocks"].extend([
-                    {"page": page_num, "bbox": block[:4], "text": block[4]} 
-                    for block in blocks
-                ])
+                    # Extrair blocos de texto
+                    blocks = page.get_text("blocks")
+                    structure_info["text_blocks"].extend([
+                        {"page": page_num, "bbox": block[:4], "text": block[4]} 
+                        for block in blocks
+                    ])
                 
-                # Analisar tabelas - uma abordagem simples baseada em texto
-                text = page.get_text()
+                    # Analisar tabelas - uma abordagem simples baseada em texto
+                    text = page.get_text()
                 
-                # Detectar cabeçalhos potenciais (primeira linha de cada bloco)
-                for block in blocks:
-                    block_text = block[4]
-                    first_line = block_text.split('\n')[0] if '\n' in block_text else block_text
-                    if len(first_line.strip()) > 0 and len(first_line) < 100:  # Provavelmente um cabeçalho
-                        structure_info["potential_headers"].append({"page": page_num, "text": first_line.strip()})
+                    # Detectar cabeçalhos potenciais (primeira linha de cada bloco)
+                    for block in blocks:
+                        block_text = block[4]
+                        first_line = block_text.split('\n')[0] if '\n' in block_text else block_text
+                        if len(first_line.strip()) > 0 and len(first_line) < 100:  # Provavelmente um cabeçalho
+                            structure_info["potential_headers"].append({"page": page_num, "text": first_line.strip()})
                 
-                # Detectar tabelas por padrões de alinhamento no texto
-                lines = text.split('\n')
+                    # Detectar tabelas por padrões de alinhamento no texto
+                    lines = text.split('\n')
                 
-                # Padrões que sugerem uma tabela
-                potential_table_lines = []
-                for line in lines:
-                    # Contar número de sequências de espaços com mais de 3 espaços
-                    space_sequences = len(re.findall(r'\s{3,}', line))
-                    if space_sequences >= 2 and len(line.strip()) > 10:
-                        potential_table_lines.append(line)
+                    # Padrões que sugerem uma tabela
+                    potential_table_lines = []
+                    for line in lines:
+                        # Contar número de sequências de espaços com mais de 3 espaços
+                        space_sequences = len(re.findall(r'\s{3,}', line))
+                        if space_sequences >= 2 and len(line.strip()) > 10:
+                            potential_table_lines.append(line)
                 
-                # Se encontramos linhas que parecem de tabela
-                if len(potential_table_lines) > 3:  # Pelo menos 3 linhas para considerar uma tabela
-                    structure_info["has_tables"] = True
-                    structure_info["detected_tables"].append({
-                        "page": page_num,
-                        "sample_lines": potential_table_lines[:3],
-                        "estimated_rows": len(potential_table_lines)
-                    })
+                    # Se encontramos linhas que parecem de tabela
+                    if len(potential_table_lines) > 3:  # Pelo menos 3 linhas para considerar uma tabela
+                        structure_info["has_tables"] = True
+                        structure_info["detected_tables"].append({
+                            "page": page_num,
+                            "sample_lines": potential_table_lines[:3],
+                            "estimated_rows": len(potential_table_lines)
+                        })
             
             return structure_info
             
@@ -158,19 +161,25 @@ class ContextAgent:
                 "error": str(e)
             }
     
-    async def _prepare_first_page_image(self, document_path: str) -> Optional[Image.Image]:
+    async def _prepare_first_page_image(
+        self, document_path: str, first_page_path: Optional[str] = None
+    ) -> Optional[Image.Image]:
         """
         Prepara a imagem da primeira página para análise
         
         Args:
             document_path: Caminho para o documento
+            first_page_path: Imagem já otimizada da primeira página, se o chamador a tiver renderizado
             
         Returns:
             Optional[Image.Image]: Imagem da primeira página ou None se falhar
         """
         try:
+            if first_page_path:
+                return Image.open(first_page_path)
+            
             # Converter apenas a primeira página
-            image_paths = convert_pdf_to_images(document_path, CONVERTED_DIR, pages=[0])
+            image_paths = await asyncio.to_thread(convert_pdf_to_images, document_path, CONVERTED_DIR, pages=[0])
             
             if not image_paths or len(image_paths) == 0:
                 logger.warning(f"Não foi possível converter a primeira página para imagem")
@@ -273,7 +282,7 @@ class ContextAgent:
         
         try:
             # Gerar resposta com base na imagem e no prompt
-            context_response = self.model.generate_content([context_prompt, image])
+            context_response = await self.model.generate_content_async([context_prompt, image])
             context_text = context_response.text
             
             # Extrair JSON da resposta
@@ -379,7 +388,7 @@ class ContextAgent:
             """
             
             # Gerar resposta
-            response = self.model.generate_content(prompt)
+            response = await self.model.generate_content_async(prompt)
             context_text = response.text
             
             # Extrair JSON
@@ -390,6 +399,7 @@ class ContextAgent:
                 logger.warning("JSON inválido na resposta de análise com texto. Usando fallback.")
                 context_info = fallback_info.copy()
                 context_info["layout_info"] = self._generate_layout_info(doc_structure)
+                context_info["_fallback"] = True
                 return context_info
             
             # Garantir campos obrigatórios
@@ -411,6 +421,7 @@ class ContextAgent:
             # Usar fallback com informações de layout baseadas na estrutura
             result = fallback_info.copy()
             result["layout_info"] = self._generate_layout_info(doc_structure)
+            result["_fallback"] = True
             return result
     
     def _format_structure_hint(self, doc_structure: Dict[str, Any]) -> str:
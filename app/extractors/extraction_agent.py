@@ -1,19 +1,36 @@
 # app/extractors/extraction_agent.py
 import os
 import json
+import asyncio
 import logging
 import re
 from typing import Dict, Any, List, Optional, Tuple
 import google.generativeai as genai
 from PIL import Image
 
-from app.config import GEMINI_API_KEY, GEMINI_MODEL
+from app.config import GEMINI_API_KEY, GEMINI_MODEL, GEMINI_MAX_RETRIES, GEMINI_MAX_CONCURRENCY
 from app.utils.file_utils import optimize_image
 from app.data.reference_data import CATEGORIES
 from app.utils.size_detection import SizeDetectionAgent
 
 logger = logging.getLogger(__name__)
 
+# Limita as chamadas simultâneas ao Gemini em todo o processo (todos os jobs) para não exceder a quota
+_GEMINI_SEMAPHORE: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+def _gemini_semaphore() -> asyncio.Semaphore:
+    """Devolve o semáforo do Gemini, criado no event loop em execução"""
+    global _GEMINI_SEMAPHORE
+    loop = asyncio.get_running_loop()
+    if _GEMINI_SEMAPHORE is None or _GEMINI_SEMAPHORE[0] is not loop:
+        _GEMINI_SEMAPHORE = (loop, asyncio.Semaphore(GEMINI_MAX_CONCURRENCY))
+    return _GEMINI_SEMAPHORE[1]
+
+try:
+    from google.api_core.exceptions import ResourceExhausted
+except ImportError:
+    ResourceExhausted = None
+
 class ExtractionAgent:
     def __init__(self, api_key: str = GEMINI_API_KEY):
 
@@ -34,8 +51,8 @@ class ExtractionAgent:
         is_first_page = (page_number == 1)
         
         try:
-            # Otimizar imagem para melhor processamento
-            optimized_path = optimize_image(image_path, os.path.dirname(image_path))
+            # Otimizar imagem para melhor processamento (decode/resize/JPEG fora do event loop)
+            optimized_path = await asyncio.to_thread(optimize_image, image_path, os.path.dirname(image_path))
             
             # Carregar a imagem
             image = Image.open(optimized_path)
@@ -55,7 +72,7 @@ class ExtractionAgent:
                     context, page_number, total_pages, previous_products_count, json_template
                 )
             
-            response = self.model.generate_content([prompt, image])
+            response = await self._generate_with_backoff([prompt, image], page_number)
             response_text = response.text
             
             # Extrair e processar o JSON da resposta
@@ -89,21 +106,39 @@ class ExtractionAgent:
             logger.error(f"Erro ao processar página {page_number}: {str(e)}")
             return {"error": str(e), "products": []}
     
-    async def extract_from_page(self, image_path: str, context: str, page_number: int, 
+    async def _generate_with_backoff(self, contents: List[Any], page_number: int):
+        """
+        Chama o Gemini com backoff exponencial quando a quota é excedida (429)
+        
+        O semáforo só é ocupado durante cada pedido: a espera do backoff não retém vaga.
+        """
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            try:
+                async with _gemini_semaphore():
+                    return await self.model.generate_content_async(contents)
+            except Exception as e:
+                if ResourceExhausted is None or not isinstance(e, ResourceExhausted) or attempt == GEMINI_MAX_RETRIES:
+                    raise
+                delay = 2 ** attempt
+                logger.warning(f"⏳ Quota Gemini excedida na página {page_number}, nova tentativa em {delay}s "
+                               f"({attempt + 1}/{GEMINI_MAX_RETRIES})")
+                await asyncio.sleep(delay)
+    
+    async def extract_from_page(self, image_path: Any, context: str, page_number: int, 
                                total_pages: int, previous_results: List[Dict]) -> Dict[str, Any]:
         """
-        Versão melhorada com prompt focado em tamanhos
+        Versão melhorada com prompt focado em tamanhos (aceita caminho ou imagem PIL)
         """
         
         # PROMPT MELHORADO - A chave para resolver tudo
         enhanced_context = self._add_size_focused_instructions(context)
         
         try:
-            image = Image.open(image_path)
-            response = self.model.generate_content([enhanced_context, image])
+            image = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+            response = await self._generate_with_backoff([enhanced_context, image], page_number)
             
-            # Parse da resposta
-            result = self._parse_extraction_response(response.text)
+            # Parse da resposta (mesma limpeza de process_page: nomes nulos passam a "")
+            result = self._extract_and_clean_json(response.text, page_number)
             
             # USAR SEU SIZE_DETECTION_AGENT para validar/melhorar
             if result.get('products'):
@@ -807,6 +842,7 @@ class ExtractionAgent:
                     # Tentar consertar o JSON do produto
                     fixed_text = product_text.replace("'", '"')
                     product = json.loads(f"{{{fixed_text}}}")
+                    product["name"] = product.get("name") or ""
                     products.append(product)
                 except:
                     continue
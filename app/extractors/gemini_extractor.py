@@ -1,34 +1,39 @@
 # app/extractors/gemini_extractor.py
 import os
+import sys
+import asyncio
+import copy
+import hashlib
 import json
 import logging
+import threading
 import time
-from typing import Dict, Any, List, Optional, Callable, Tuple
+from collections import ChainMap, OrderedDict
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
+from typing import Dict, Any, List, Optional, Callable, Set, Tuple
 import re 
 import math
-import numpy as np
 from PIL import Image 
 
-from app.config import GEMINI_API_KEY, GEMINI_MODEL, CONVERTED_DIR
+from app.config import GEMINI_API_KEY, GEMINI_MODEL, CONVERTED_DIR, RESULTS_DIR, PRETTY_RESULTS_JSON
 from app.extractors.base import BaseExtractor
 from app.extractors.context_agent import ContextAgent
 from app.extractors.extraction_agent import ExtractionAgent
 from app.extractors.color_mapping_agent import ColorMappingAgent
 from app.extractors.layout_detetion_agent import LayoutDetetionAgent
 from app.extractors.generic_strategy_agent import GenericStrategyAgent
-from app.extractors.validators.size_color_validation_agent import SizeColorValidationAgent, SizeColorValidationResult
-from app.extractors.validators.validation_agent import ValidationAgent, ValidationResult
 
-from app.utils.file_utils import convert_pdf_to_images
-from app.utils.barcode_generator import add_barcodes_to_extraction_result, add_barcodes_to_products
+from app.utils.file_utils import convert_pdf_to_images, get_pdf_page_count, optimize_image, rasterize_pdf_in_memory
 from app.data.reference_data import (get_supplier_code, get_markup, get_category,SUPPLIER_MAP, COLOR_MAP, SIZE_MAP,CATEGORIES)
-from app.utils.json_utils import safe_json_dump, fix_nan_in_products, sanitize_for_json
-from app.utils.supplier_assignment import determine_best_supplier, assign_supplier_to_products
+from app.utils.supplier_assignment import determine_best_supplier
 from app.data.reference_data import determine_gender_by_brand
 
 logger = logging.getLogger(__name__)
 
 try:
+    from app.extractors.validators.validation_agent import ValidationAgent, ValidationResult
     HAS_VALIDATION = True
     logger.info("✅ Sistema de validação melhorado carregado")
 except ImportError:
@@ -36,6 +41,7 @@ except ImportError:
     logger.warning("⚠️ Sistema de validação não disponível")
 
 try:
+    from app.extractors.validators.size_color_validation_agent import SizeColorValidationAgent, SizeColorValidationResult
     HAS_SIZE_VALIDATION = True
     logger.info("✅ Sistema de validação de tamanhos carregado")
 except ImportError:
@@ -49,7 +55,102 @@ except ImportError:
     has_json_utils = False
     logger.warning("Módulo json_utils não encontrado, usar serialização padrão")
 
+try:
+    from app.utils.barcode_generator import add_barcodes_to_products
+except ImportError:
+    add_barcodes_to_products = None
+    logger.warning("Módulo barcode_generator não encontrado, pulando geração de códigos de barras")
+
+# Marcas que não devem sobrepor a marca dos produtos
+_BRAND_SENTINELS = frozenset(("", "Marca não identificada"))
+
+def _intern_str(value: Any) -> Any:
+    """Partilha uma única instância para códigos/nomes curtos repetidos entre referências"""
+    return sys.intern(value) if type(value) is str else value
+
+@lru_cache(maxsize=256)
+def _readable_key(key: str) -> str:
+    """Converte uma chave de instrução (snake_case) num título legível"""
+    return key.replace('_', ' ').title()
+
+# Padrões da limpeza de nomes de produtos
+_NAME_RE = re.compile(r'^([A-Za-z\s]+)(?:\s+\d+.*)?$')
+_DIGIT_TABLE = str.maketrans('', '', '0123456789')
+
+_POLO_TERMS = ('POLO', 'POLOSHIRT')
+_MALHA_TERMS = ('SWEATER', 'SWEAT', 'MALHA', 'JERSEY')
+
+# Lado máximo (px) das páginas enviadas ao Gemini nos passos de validação
+_VALIDATION_MAX_DIMENSION = 1568
+
+@lru_cache(maxsize=32)
+def _render_strategy_update(strategy_name: str, page_number: int, instructions: Tuple[Tuple[str, str], ...]) -> str:
+    """Monta o bloco de estratégia adaptada para uma página"""
+    strategy_update = f"""
+            ## ESTRATÉGIA ADAPTADA PARA PÁGINA {page_number}
+
+            ⚠️ **MUDANÇA DE ESTRATÉGIA**
+            - Nova estratégia: {strategy_name}
+            - Motivo: Resultado anterior insatisfatório
+            - Aplicar novas instruções:
+
+            ### INSTRUÇÕES ATUALIZADAS:
+            """
+    
+    return strategy_update + "".join(
+        f"- **{_readable_key(key)}**: {instruction}\n" for key, instruction in instructions
+    )
+
+# Palavras-chave das recomendações da validação -> foco da re-extração
+_RETRY_FOCUS_RE = re.compile(r'tamanho|quantidade|agrup', re.IGNORECASE)
+_RETRY_FOCUS = {'tamanho': 'sizes', 'quantidade': 'quantities', 'agrup': 'grouping'}
+
+@lru_cache(maxsize=256)
+def _normalize_category(category_upper: str) -> str:
+    """Normaliza uma categoria (já em maiúsculas) para uma das CATEGORIES"""
+    if any(term in category_upper for term in _POLO_TERMS):
+        return "POLOS"
+    if any(term in category_upper for term in _MALHA_TERMS):
+        return "MALHAS"
+    
+    # Para outras categorias, procurar correspondência em CATEGORIES
+    for category in CATEGORIES:
+        if category in category_upper or category_upper in category:
+            return category
+    
+    # Se não encontrar, usar "ACESSÓRIOS" como fallback
+    return "ACESSÓRIOS"
+
+def _sanitize_nan_in_place(obj: Any) -> None:
+    """Substitui NaN/Infinity por 0.0 diretamente nos dicts/listas, sem criar cópia"""
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+    else:
+        return
+    for key, value in items:
+        if isinstance(value, float) and not math.isfinite(value):
+            obj[key] = 0.0
+        elif isinstance(value, (dict, list)):
+            _sanitize_nan_in_place(value)
+
+def _doc_fingerprint(path: str) -> str:
+    """Hash do conteúdo do documento (lido em blocos de 1 MiB)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class GeminiExtractor(BaseExtractor):
+    # Cache partilhado das secções de layout/estratégia do contexto melhorado
+    _ENHANCED_CONTEXT_CACHE: "OrderedDict[Tuple, str]" = OrderedDict()
+    _ENHANCED_CONTEXT_CACHE_SIZE = 128
+    # Cache partilhado das análises de contexto/layout por conteúdo do documento
+    _DOC_ANALYSIS_CACHE: "OrderedDict[Tuple, Any]" = OrderedDict()
+    _DOC_ANALYSIS_CACHE_SIZE = 32
+
     def __init__(self, api_key: str = GEMINI_API_KEY):
         self.api_key = api_key
         self.context_agent = ContextAgent(api_key)
@@ -59,7 +160,7 @@ class GeminiExtractor(BaseExtractor):
         self.layout_detector = LayoutDetetionAgent(api_key)
         self.strategy_agent = GenericStrategyAgent()
 
-        self.validation_agent = ValidationAgent(api_key)
+        self.validation_agent = ValidationAgent(api_key) if HAS_VALIDATION else None
         
         if HAS_SIZE_VALIDATION:
             try:
@@ -74,14 +175,44 @@ class GeminiExtractor(BaseExtractor):
         self.current_layout_analysis = {}
         self.current_strategy = None
         self.page_results_history = []
+        self._strategies_seen = set()
+        
+        # Páginas rasterizadas em memória por hash do conteúdo do documento
+        self._raster_cache: "OrderedDict[str, List[Image.Image]]" = OrderedDict()
+
+    @property
+    def _strategy_name(self) -> str:
+        """Nome da estratégia atual (ou "unknown" se ainda não houver)"""
+        return self.current_strategy.name if self.current_strategy else "unknown"
 
-    async def analyze_context(self, document_path: str) -> str:
+    @property
+    def _layout_type(self) -> str:
+        """Tipo de layout detetado para o documento atual"""
+        return self.current_layout_analysis.get('layout_type', 'UNKNOWN')
+
+    async def analyze_context(self, document_path: str, first_page_path: Optional[str] = None) -> str:
         logger.info("🔧 Usando análise clássica")
         
-        context_info = await self.context_agent.analyze_document(document_path)
+        try:
+            fingerprint = await asyncio.to_thread(_doc_fingerprint, document_path)
+        except OSError as e:
+            logger.warning(f"Não foi possível calcular o hash do documento: {e}")
+            fingerprint = None
         
-        logger.info("Detectando layout do documento...")
-        layout_analysis = await self.layout_detector.analyze_document_structure(document_path)
+        # Contexto e layout são independentes: as duas chamadas ao Gemini correm em paralelo
+        logger.info("Analisando contexto e detectando layout do documento...")
+        context_info, layout_analysis = await asyncio.gather(
+            self._cached_analysis(
+                fingerprint, "context", self.context_agent.analyze_document, document_path,
+                # O contexto depende também do nome do ficheiro (prompt, file_name, fornecedor)
+                extra_key=(os.path.basename(document_path),),
+                first_page_path=first_page_path
+            ),
+            self._cached_analysis(
+                fingerprint, "layout", self.layout_detector.analyze_document_structure, document_path,
+                first_page_path=first_page_path
+            ),
+        )
         
         layout_type = layout_analysis.get('layout_type', 'UNKNOWN')
         confidence = layout_analysis.get('confidence', 0.0)
@@ -104,21 +235,58 @@ class GeminiExtractor(BaseExtractor):
         
         return enhanced_context
 
+    async def _cached_analysis(
+        self,
+        fingerprint: Optional[str],
+        kind: str,
+        analyze: Callable,
+        document_path: str,
+        extra_key: Tuple = (),
+        **kwargs
+    ) -> Any:
+        """
+        Reutiliza a análise (contexto ou layout) de um documento com o mesmo conteúdo
+        """
+        if fingerprint is None:
+            return await analyze(document_path, **kwargs)
+        
+        cache_key = (fingerprint, GEMINI_MODEL, kind) + extra_key
+        cached = self._DOC_ANALYSIS_CACHE.get(cache_key)
+        if cached is not None:
+            self._DOC_ANALYSIS_CACHE.move_to_end(cache_key)
+            logger.info(f"♻️ Análise de {kind} reutilizada da cache")
+            return copy.deepcopy(cached)
+        
+        result = await analyze(document_path, **kwargs)
+        
+        # Não guardar resultados de falhas (podem ser transitórias, ex. quota da API)
+        if isinstance(result, dict) and (
+            result.get("error") or result.get("_fallback")
+            or (result.get("visual_analysis") or {}).get("error")
+        ):
+            return result
+        
+        self._DOC_ANALYSIS_CACHE[cache_key] = copy.deepcopy(result)
+        if len(self._DOC_ANALYSIS_CACHE) > self._DOC_ANALYSIS_CACHE_SIZE:
+            self._DOC_ANALYSIS_CACHE.popitem(last=False)
+        return result
+
     async def _retry_extraction_with_different_strategy(self, 
                                                    document_path: str,
                                                    recommendations: List[str]) -> List[Dict]:
         try:
+            if not recommendations:
+                logger.info("Sem recomendações da validação - re-extração ignorada")
+                return []
+            
             logger.info("🔄 Tentando re-extração com estratégia alternativa...")
             
             # Analisar recomendações para escolher estratégia
-            retry_focus = []
-            
-            if any("tamanho" in rec.lower() for rec in recommendations):
-                retry_focus.append("sizes")
-            if any("quantidade" in rec.lower() for rec in recommendations):
-                retry_focus.append("quantities")
-            if any("agrup" in rec.lower() for rec in recommendations):
-                retry_focus.append("grouping")
+            retry_focus = {
+                _RETRY_FOCUS[match.group().lower()]
+                for rec in recommendations
+                for match in _RETRY_FOCUS_RE.finditer(rec)
+            }
             
             # Executar re-extração focada
             if "sizes" in retry_focus or "quantities" in retry_focus:
@@ -132,12 +300,28 @@ class GeminiExtractor(BaseExtractor):
             logger.warning(f"Erro na re-extração: {e}")
             return []
 
+    async def _extract_pages_concurrently(self, images: List[Image.Image], context: Any) -> List[Dict]:
+        """
+        Re-extrai todas as páginas em paralelo, limitado pelo semáforo do Gemini (no ExtractionAgent)
+        """
+        total_pages = len(images)
+        
+        async def extract_one(page_number: int, image: Image.Image) -> Dict[str, Any]:
+            return await self.extraction_agent.extract_from_page(
+                image, context, page_number, total_pages, []
+            )
+        
+        results = await asyncio.gather(
+            *(extract_one(i, image) for i, image in enumerate(images, start=1))
+        )
+        return [product for result in results for product in result.get('products', [])]
+
     async def _focused_size_quantity_extraction(self, document_path: str) -> List[Dict]:
         """
         Re-extração focada em tamanhos e quantidades corretos
         """
         try:
-            images = self._get_document_images_safe(document_path)
+            images = await self._get_document_images_safe(document_path)
             if not images:
                 return []
             
@@ -182,11 +366,7 @@ class GeminiExtractor(BaseExtractor):
             CRÍTICO: Incluir TODOS os tamanhos visíveis, mesmo com quantidade 0
             """
             
-            result = await self.extraction_agent.extract_from_page(
-                images[0], focused_prompt, 1, len(images), []
-            )
-            
-            return result.get('products', [])
+            return await self._extract_pages_concurrently(images, focused_prompt)
             
         except Exception as e:
             logger.warning(f"Erro na re-extração focada: {e}")
@@ -197,7 +377,7 @@ class GeminiExtractor(BaseExtractor):
         Re-extração focada em agrupamento correto de produtos
         """
         try:
-            images = self._get_document_images_safe(document_path)
+            images = await self._get_document_images_safe(document_path)
             if not images:
                 return []
             
@@ -234,42 +414,12 @@ class GeminiExtractor(BaseExtractor):
             }}
             """
             
-            result = await self.extraction_agent.extract_from_page(
-                images[0], grouping_prompt, 1, len(images), []
-            )
-            
-            return result.get('products', [])
+            return await self._extract_pages_concurrently(images, grouping_prompt)
             
         except Exception as e:
             logger.warning(f"Erro na re-extração de agrupamento: {e}")
             return []
 
-    async def _generic_retry_extraction(self, document_path: str) -> List[Dict]:
-        """
-        Re-extração genérica com prompt mais rigoroso
-        """
-        try:
-            images = self._get_document_images_safe(document_path)
-            if not images:
-                return []
-            
-            context = self.current_context_info.copy() if self.current_context_info else {}
-            context.update({
-                'extraction_mode': 'retry_conservative',
-                'focus': 'accuracy_over_speed',
-                'validation': 'strict'
-            })
-            
-            result = await self.extraction_agent.extract_from_page(
-                images[0], context, 1, len(images), []
-            )
-            
-            return result.get('products', [])
-            
-        except Exception as e:
-            logger.warning(f"Erro no retry genérico: {e}")
-            return []
-    
     async def extract_with_validation(self, document_path: str, 
                                 enable_validation: bool = True,
                                 max_retries: int = 1) -> Dict[str, Any]:
@@ -304,7 +454,7 @@ class GeminiExtractor(BaseExtractor):
                 logger.info(f"🔍 Páginas com falha detectadas: {failed_pages}")
             
             # 4. Obter imagens para validação
-            images = self._get_document_images_safe(document_path)
+            images = await self._get_document_images_safe(document_path)
             if not images:
                 logger.warning("⚠️ Sem imagens para validação visual")
                 extraction_result['validation'] = {
@@ -342,12 +492,13 @@ class GeminiExtractor(BaseExtractor):
             logger.info(f"   - Confiança: {validation_result.confidence_score:.2f}")
             
             # 7. Log das correções aplicadas
-            if validation_result.corrections_applied:
+            if validation_result.corrections_applied and logger.isEnabledFor(logging.INFO):
                 logger.info("🔧 Correções aplicadas:")
-                for correction in validation_result.corrections_applied[:5]:
+                for correction in islice(validation_result.corrections_applied, 5):
                     logger.info(f"   - {correction}")
-                if len(validation_result.corrections_applied) > 5:
-                    logger.info(f"   - ... e mais {len(validation_result.corrections_applied) - 5}")
+                extras = len(validation_result.corrections_applied) - 5
+                if extras > 0:
+                    logger.info(f"   - ... e mais {extras}")
             
             # 8. Log das recomendações
             if validation_result.recommendations:
@@ -368,17 +519,21 @@ class GeminiExtractor(BaseExtractor):
                     document_path, validation_result.recommendations
                 )
                 
-                if alternative_products:
-                    validation_result = await self.validation_agent.validate_extraction(
-                        extracted_products=alternative_products,
-                        original_context=context,
-                        pdf_pages=images,
-                        layout_analysis=self.current_layout_analysis
-                    )
+                # Sem produtos alternativos, repetir o retry com as mesmas recomendações não adianta
+                if not alternative_products:
+                    break
+                
+                validation_result = await self.validation_agent.validate_extraction(
+                    extracted_products=alternative_products,
+                    original_context=context,
+                    pdf_pages=images,
+                    layout_analysis=self.current_layout_analysis
+                )
             
             # 10. Preparar resultado final melhorado
-            enhanced_result = extraction_result.copy()
-            enhanced_result.update({
+            # O fallback devolve extraction_result intacto: construir um novo dict
+            enhanced_result = {
+                **extraction_result,
                 'products': validation_result.products,
                 'validation': {
                     'enabled': True,
@@ -400,7 +555,7 @@ class GeminiExtractor(BaseExtractor):
                     'corrections_applied': validation_result.corrections_applied,
                     'failed_pages_detected': failed_pages
                 }
-            })
+            }
             
             # 11. Status final
             if validation_result.confidence_score >= 0.8:
@@ -436,75 +591,91 @@ class GeminiExtractor(BaseExtractor):
             merged_count = len(initial_products) - len(corrected_products)
             improvements.append(f"Agrupados {merged_count} produtos duplicados por cor")
         
-        # Detectar correções de tamanhos
-        initial_sizes = set()
-        corrected_sizes = set()
-        
-        for product in initial_products:
-            for color in product.get('colors', []):
-                for size in color.get('sizes', []):
-                    initial_sizes.add(size.get('size', ''))
-        
-        for product in corrected_products:
-            for color in product.get('colors', []):
-                for size in color.get('sizes', []):
-                    corrected_sizes.add(size.get('size', ''))
+        # Detectar correções de tamanhos e completude (uma só passagem por lista)
+        initial_sizes, initial_complete = self._scan_sizes_and_completeness(initial_products)
+        corrected_sizes, corrected_complete = self._scan_sizes_and_completeness(corrected_products)
         
         # Verificar se houve mudanças significativas nos tamanhos
         size_changes = corrected_sizes - initial_sizes
         if size_changes:
-            improvements.append(f"Corrigidos tamanhos incorretos: {', '.join(list(size_changes)[:3])}")
+            improvements.append(f"Corrigidos tamanhos incorretos: {', '.join(islice(size_changes, 3))}")
         
         # Detectar melhorias na completude
-        initial_complete = sum(1 for p in initial_products if self._is_product_complete(p))
-        corrected_complete = sum(1 for p in corrected_products if self._is_product_complete(p))
-        
         if corrected_complete > initial_complete:
             improvement = corrected_complete - initial_complete
             improvements.append(f"Recuperados dados completos para {improvement} produtos")
         
         return improvements
 
-    def _is_product_complete(self, product: Dict) -> bool:
-        """Verifica se produto tem dados completos"""
-        if not product.get('material_code') or not product.get('product_name'):
-            return False
-        
-        colors = product.get('colors', [])
-        if not colors:
-            return False
-        
-        for color in colors:
-            sizes = color.get('sizes', [])
-            if sizes and any(s.get('quantity', 0) > 0 for s in sizes):
-                return True
-        
-        return False
+    @staticmethod
+    def _scan_sizes_and_completeness(products: List[Dict]) -> Tuple[Set[str], int]:
+        """
+        Recolhe os tamanhos usados e conta os produtos completos
+        (código, nome e pelo menos uma quantidade positiva) numa única passagem
+        """
+        sizes_seen = set()
+        complete = 0
+        for product in products:
+            has_quantity = False
+            for color in product.get('colors') or ():
+                for size in color.get('sizes') or ():
+                    sizes_seen.add(size.get('size', ''))
+                    if (size.get('quantity') or 0) > 0:
+                        has_quantity = True
+            if has_quantity and product.get('material_code') and product.get('product_name'):
+                complete += 1
+        return sizes_seen, complete
+
+    @staticmethod
+    def _supplier_markup(supplier: str) -> float:
+        """Markup do fornecedor indicado no contexto (2.73 se desconhecido)"""
+        supplier_code = get_supplier_code(supplier) if supplier else None
+        markup_value = get_markup(supplier_code) if supplier_code else None
+        return markup_value or 2.73
+
+    @staticmethod
+    def _is_pdf(document_path: str) -> bool:
+        """Deteta PDFs pela assinatura (%PDF-) no primeiro KiB do ficheiro, com a extensão como recurso"""
+        try:
+            # A especificação tolera lixo antes do cabeçalho (leitores aceitam até 1024 bytes)
+            with open(document_path, 'rb') as f:
+                if b'%PDF-' in f.read(1024):
+                    return True
+        except OSError:
+            pass
+        return document_path.lower().endswith('.pdf')
 
-    def _get_document_images_safe(self, document_path: str) -> List[Image.Image]:
+    async def _get_document_images_safe(self, document_path: str) -> List[Image.Image]:
         """Método melhorado para obter imagens"""
         try:
-            if not document_path.lower().endswith('.pdf'):
+            if not self._is_pdf(document_path):
                 logger.info("Documento não é PDF - validação visual limitada")
                 return []
             
-            # Usar método existente de conversão
-            image_paths = convert_pdf_to_images(document_path, CONVERTED_DIR)
+            # Hash e rasterização fora do event loop (I/O e CPU bloqueantes)
+            fingerprint = await asyncio.to_thread(_doc_fingerprint, document_path)
+            cached = self._raster_cache.get(fingerprint)
+            if cached is not None:
+                self._raster_cache.move_to_end(fingerprint)
+                logger.info(f"♻️ Reutilizando {len(cached)} imagens já rasterizadas")
+                return list(cached)
+            
+            # Rasterizar diretamente em memória (sem PNGs intermédios em disco)
+            images = await asyncio.to_thread(
+                rasterize_pdf_in_memory,
+                document_path, max_dimension=_VALIDATION_MAX_DIMENSION
+            )
             
-            if not image_paths:
+            if not images:
                 logger.warning("Não foi possível converter PDF para imagens")
                 return []
             
-            images = []
-            for img_path in image_paths:
-                try:
-                    img = Image.open(img_path)
-                    images.append(img)
-                except Exception as e:
-                    logger.warning(f"⚠️ Erro ao carregar imagem {img_path}: {e}")
+            self._raster_cache[fingerprint] = images
+            if len(self._raster_cache) > 4:
+                self._raster_cache.popitem(last=False)
             
             logger.info(f"🖼️ Carregadas {len(images)} imagens para validação")
-            return images
+            return list(images)
             
         except Exception as e:
             logger.warning(f"⚠️ Erro ao obter imagens do documento: {e}")
@@ -532,7 +703,7 @@ class GeminiExtractor(BaseExtractor):
                 return extraction_result
             
             # 3. Obter imagens para análise visual
-            images = self._get_document_images_safe(document_path)
+            images = await self._get_document_images_safe(document_path)
             if not images:
                 logger.warning("⚠️ Sem imagens para validação visual de tamanhos")
                 extraction_result['size_validation'] = {
@@ -563,12 +734,13 @@ class GeminiExtractor(BaseExtractor):
             logger.info(f"   - Confiança: {validation_result.confidence_score:.2f}")
             
             # 6. Log das correções aplicadas
-            if corrections_made:
+            if corrections_made and logger.isEnabledFor(logging.INFO):
                 logger.info("🔧 Correções aplicadas:")
-                for correction in corrections_made[:5]:  # Primeiras 5
+                for correction in islice(corrections_made, 5):  # Primeiras 5
                     logger.info(f"   - {correction}")
-                if len(corrections_made) > 5:
-                    logger.info(f"   - ... e mais {len(corrections_made) - 5} correções")
+                extras = len(corrections_made) - 5
+                if extras > 0:
+                    logger.info(f"   - ... e mais {extras} correções")
             
             # 7. Detectar melhorias específicas
             improvements = self._analyze_improvements(initial_products, corrected_products)
@@ -578,8 +750,8 @@ class GeminiExtractor(BaseExtractor):
                     logger.info(f"   - {improvement}")
             
             # 8. Preparar resultado final
-            enhanced_result = extraction_result.copy()
-            enhanced_result.update({
+            enhanced_result = {
+                **extraction_result,
                 'products': corrected_products,
                 'size_validation': {
                     'enabled': True,
@@ -594,7 +766,7 @@ class GeminiExtractor(BaseExtractor):
                     'improvements_detected': improvements,
                     'confidence_threshold_used': confidence_threshold
                 }
-            })
+            }
             
             # 9. Status final
             if validation_result.confidence_score >= 0.8:
@@ -634,7 +806,7 @@ class GeminiExtractor(BaseExtractor):
                 logger.info(f"Usando estratégia alternativa: {alternative_strategy.name}")
                 
                 # Re-extrair com nova estratégia
-                images = self._get_document_images(document_path)
+                images = await self._get_document_images_safe(document_path)
                 if images:
                     enhanced_context = self._enhance_context_with_layout_and_strategy(
                         self.current_context_info, alternative_layout, alternative_strategy
@@ -656,23 +828,26 @@ class GeminiExtractor(BaseExtractor):
         """Retry genérico com parâmetros ajustados"""
         try:
             # Extrair novamente mas com prompt modificado para ser mais rigoroso
-            images = self._get_document_images(document_path)
+            images = await self._get_document_images_safe(document_path)
             if not images:
                 return []
             
-            # Criar contexto mais específico para retry
-            retry_context = self.current_context_info.copy() if self.current_context_info else {}
-            retry_context.update({
+            # Criar contexto mais específico para retry (sem copiar o contexto original)
+            retry_overrides = {
                 'extraction_mode': 'retry',
                 'focus': 'complete_products_only',
                 'strictness': 'high'
-            })
+            }
+            retry_context = ChainMap(retry_overrides, self.current_context_info or {})
             
-            result = await self.extraction_agent.extract_from_page(
-                images[0], retry_context, 1, len(images), []
-            )
+            # O agente de extração espera texto: formatar uma única vez para todas as páginas
+            retry_prompt = "\n\n".join([
+                self.context_agent.format_context_for_extraction(retry_context),
+                "## Modo de Re-extração",
+                "\n".join(f"{_readable_key(key)}: {value}" for key, value in retry_overrides.items())
+            ])
             
-            return result.get('products', [])
+            return await self._extract_pages_concurrently(images, retry_prompt)
             
         except Exception as e:
             logger.warning(f"Erro no retry genérico: {e}")
@@ -687,42 +862,75 @@ class GeminiExtractor(BaseExtractor):
 
         original_context = self.context_agent.format_context_for_extraction(context_info)
         
+        technical = layout_analysis.get("technical_analysis", {})
+        column_count = 0
+        if not technical.get("error"):
+            column_count = technical.get("column_detection", {}).get("column_count", 0)
+        
+        extraction_instructions = layout_analysis.get("extraction_instructions", {}) or {}
+        
+        # Só o contexto original varia por documento; o resto depende do layout e da estratégia
+        cache_key = (
+            layout_analysis.get('layout_type', 'UNKNOWN'),
+            f"{layout_analysis.get('confidence', 0):.2f}",
+            str(layout_analysis.get('extraction_strategy', 'adaptive')),
+            column_count,
+            strategy.name,
+            strategy.approach,
+            tuple((key, str(instruction)) for key, instruction in strategy.specific_instructions.items()),
+            bool(extraction_instructions),
+            tuple((key, str(instruction)) for key, instruction in extraction_instructions.items()
+                  if instruction and key != "special_considerations")
+        )
+        
+        layout_strategy_block = self._ENHANCED_CONTEXT_CACHE.get(cache_key)
+        if layout_strategy_block is None:
+            layout_strategy_block = self._build_layout_strategy_block(cache_key)
+            self._ENHANCED_CONTEXT_CACHE[cache_key] = layout_strategy_block
+            if len(self._ENHANCED_CONTEXT_CACHE) > self._ENHANCED_CONTEXT_CACHE_SIZE:
+                self._ENHANCED_CONTEXT_CACHE.popitem(last=False)
+        else:
+            self._ENHANCED_CONTEXT_CACHE.move_to_end(cache_key)
+        
+        return "\n".join([original_context, layout_strategy_block])
+
+    @staticmethod
+    def _build_layout_strategy_block(cache_key: Tuple) -> str:
+        """Monta as secções de layout, estratégia e regras a partir da chave de cache"""
+        (layout_type, confidence, extraction_strategy, column_count,
+         strategy_name, approach, specific_instructions,
+         has_layout_instructions, layout_instructions) = cache_key
+        
         layout_info = [
             "\n## LAYOUT DETECTADO AUTOMATICAMENTE",
-            f"**Tipo**: {layout_analysis.get('layout_type', 'UNKNOWN')}",
-            f"**Confiança**: {layout_analysis.get('confidence', 0):.2f}",
-            f"**Estratégia**: {layout_analysis.get('extraction_strategy', 'adaptive')}"
+            f"**Tipo**: {layout_type}",
+            f"**Confiança**: {confidence}",
+            f"**Estratégia**: {extraction_strategy}"
         ]
         
-        technical = layout_analysis.get("technical_analysis", {})
-        if not technical.get("error"):
-            column_info = technical.get("column_detection", {})
-            if column_info.get("column_count", 0) > 0:
-                layout_info.append(f"**Colunas detectadas**: {column_info['column_count']}")
+        if column_count > 0:
+            layout_info.append(f"**Colunas detectadas**: {column_count}")
         
         strategy_info = [
-            f"\n## ESTRATÉGIA SELECIONADA: {strategy.name.upper()}",
-            f"**Abordagem**: {strategy.approach}"
+            f"\n## ESTRATÉGIA SELECIONADA: {strategy_name.upper()}",
+            f"**Abordagem**: {approach}"
         ]
         
         # Instruções específicas da estratégia
         strategy_info.append("\n### INSTRUÇÕES ESPECÍFICAS:")
-        for key, instruction in strategy.specific_instructions.items():
-            readable_key = key.replace('_', ' ').title()
+        for key, instruction in specific_instructions:
+            readable_key = _readable_key(key)
             strategy_info.append(f"- **{readable_key}**: {instruction}")
         
         # Instruções do layout detectado
-        extraction_instructions = layout_analysis.get("extraction_instructions", {})
-        if extraction_instructions:
+        if has_layout_instructions:
             strategy_info.append("\n### INSTRUÇÕES BASEADAS NO LAYOUT:")
-            for key, instruction in extraction_instructions.items():
-                if instruction and key != "special_considerations":
-                    readable_key = key.replace('_', ' ').title()
-                    strategy_info.append(f"- **{readable_key}**: {instruction}")
+            for key, instruction in layout_instructions:
+                readable_key = _readable_key(key)
+                strategy_info.append(f"- **{readable_key}**: {instruction}")
         
         # Combinar tudo
         return "\n".join([
-            original_context,
             "\n".join(layout_info),
             "\n".join(strategy_info),
             "\n## REGRAS CRÍTICAS:",
@@ -743,39 +951,95 @@ class GeminiExtractor(BaseExtractor):
         logger.info(f"Processando página {page_number}/{total_pages}")
         
         if page_number > 1 and self.page_results_history:
-            last_result = self.page_results_history[-1]
-            new_strategy = self.strategy_agent.adapt_strategy_for_page(
-                self.current_strategy, 
-                last_result, 
-                page_number - 1,
-                self.current_layout_analysis
-            )
+            context = self._adapt_strategy_for_page(context, page_number)
+        
+        page_result = await self._process_page_isolated(
+            image_path, context, page_number, total_pages, previous_result
+        )
+        
+        # NOVA: Armazenar resultado para adaptação
+        self.page_results_history.append(page_result)
+        
+        return page_result
+
+    def _adapt_strategy_for_page(self, context: str, page_number: int) -> str:
+        """
+        Adapta a estratégia atual com base no último resultado e devolve o contexto atualizado
+        """
+        last_result = self.page_results_history[-1]
+        new_strategy = self.strategy_agent.adapt_strategy_for_page(
+            self.current_strategy, 
+            last_result, 
+            page_number - 1,
+            self.current_layout_analysis
+        )
+        
+        if new_strategy:
+            logger.info(f"ADAPTAÇÃO: {self.current_strategy.name} → {new_strategy.name}")
+            self.current_strategy = new_strategy
             
-            if new_strategy:
-                logger.info(f"ADAPTAÇÃO: {self.current_strategy.name} → {new_strategy.name}")
-                self.current_strategy = new_strategy
-                
-                # Atualizar contexto com nova estratégia
-                context = self._update_context_with_new_strategy(context, new_strategy, page_number)
+            # Atualizar contexto com nova estratégia
+            context = self._update_context_with_new_strategy(context, new_strategy, page_number)
         
+        return context
+
+    async def _process_page_isolated(
+        self, 
+        image_path: str, 
+        context: str,
+        page_number: int,
+        total_pages: int,
+        previous_result: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Processa uma página sem alterar a estratégia nem o histórico (seguro para execução concorrente)
+        """
         # Processar página (usa o ExtractionAgent original)
         page_result = await self.extraction_agent.process_page(
             image_path, context, page_number, total_pages, previous_result
         )
         
-        # NOVA: Armazenar resultado para adaptação
-        page_result["_strategy_used"] = self.current_strategy.name if self.current_strategy else "unknown"
-        self.page_results_history.append(page_result)
+        strategy_name = self._strategy_name
+        page_result["_strategy_used"] = strategy_name
+        self._strategies_seen.add(strategy_name)
         
         # Log dos resultados
         products_found = len(page_result.get("products", []))
         has_error = "error" in page_result
-        strategy_name = self.current_strategy.name if self.current_strategy else "unknown"
         
-        logger.info(f"Página {page_number}: {products_found} produtos extraídos "
-                   f"(estratégia: {strategy_name}){' COM ERRO' if has_error else ''}")
+        logger.info("Página %d: %d produtos extraídos (estratégia: %s)%s",
+                    page_number, products_found, strategy_name, " COM ERRO" if has_error else "")
         
         return page_result
+
+    def _merge_page_result(
+        self,
+        combined_result: Dict[str, Any],
+        page_result: Dict[str, Any],
+        page_number: int
+    ) -> None:
+        """
+        Mescla o resultado de uma página no resultado combinado do documento
+        """
+        # Verificar erro (mantém-se igual)
+        if "error" in page_result and not page_result.get("products"):
+            logger.error(f"❌ Erro ao processar página {page_number}: {page_result['error']}")
+            if page_number == 1:
+                raise ValueError(f"Falha ao processar a primeira página: {page_result['error']}")
+            return
+        
+        # Mesclar resultados (mantém-se igual)
+        if "products" in page_result:
+            products_found = len(page_result.get("products", []))
+            logger.info("📦 Página %d: %d produtos encontrados", page_number, products_found)  # ADICIONAR
+            combined_result["products"].extend(page_result.get("products", []))
+        
+        if page_result.get("order_info"):
+            order_info = combined_result["order_info"]
+            order_info.update({
+                key: value for key, value in page_result["order_info"].items()
+                if value and not order_info.get(key)
+            })
     
     def _update_context_with_new_strategy(
         self, 
@@ -784,22 +1048,10 @@ class GeminiExtractor(BaseExtractor):
         page_number: int
     ) -> str:
 
-        strategy_update = f"""
-            ## ESTRATÉGIA ADAPTADA PARA PÁGINA {page_number}
-
-            ⚠️ **MUDANÇA DE ESTRATÉGIA**
-            - Nova estratégia: {new_strategy.name}
-            - Motivo: Resultado anterior insatisfatório
-            - Aplicar novas instruções:
-
-            ### INSTRUÇÕES ATUALIZADAS:
-            """
-                    
-        for key, instruction in new_strategy.specific_instructions.items():
-            readable_key = key.replace('_', ' ').title()
-            strategy_update += f"- **{readable_key}**: {instruction}\n"
-        
-        return context + strategy_update
+        instructions = tuple(
+            (key, str(instruction)) for key, instruction in new_strategy.specific_instructions.items()
+        )
+        return context + _render_strategy_update(new_strategy.name, page_number, instructions)
 
     async def extract_document(
         self, 
@@ -810,6 +1062,8 @@ class GeminiExtractor(BaseExtractor):
     ) -> Dict[str, Any]:
 
         start_time = time.time()
+        conversion_task: Optional[asyncio.Task] = None
+        conversion_stop = threading.Event()
         
         try:
             logger.info(f"🚀 INICIANDO EXTRAÇÃO - Job: {job_id}")  # ADICIONAR
@@ -821,24 +1075,45 @@ class GeminiExtractor(BaseExtractor):
             }
             
             # ETAPA 1: Análise melhorada (contexto + layout + estratégia)
-            is_pdf = document_path.lower().endswith('.pdf')
+            is_pdf = self._is_pdf(document_path)
             
             if is_pdf:
                 logger.info(f"📄 Processando PDF: {document_path}")  # ADICIONAR
                 
+                logger.info("📸 Convertendo PDF para imagens...")  # ADICIONAR
+                job_dir = os.path.join(CONVERTED_DIR, job_id)
+                os.makedirs(job_dir, exist_ok=True)
+                
+                # Primeira página renderizada uma única vez e partilhada pelos agentes de contexto e layout
+                first_page_paths = await asyncio.to_thread(
+                    convert_pdf_to_images, document_path, job_dir, pages=[0]
+                )
+                first_page_path = None
+                if first_page_paths:
+                    first_page_path = await asyncio.to_thread(optimize_image, first_page_paths[0], job_dir)
+                
+                # Restantes páginas convertidas em paralelo com a análise de contexto (não depende dela)
+                page_count = await asyncio.to_thread(get_pdf_page_count, document_path)
+                conversion_task = asyncio.create_task(
+                    asyncio.to_thread(
+                        convert_pdf_to_images, document_path, job_dir,
+                        pages=list(range(1, page_count)), stop_event=conversion_stop
+                    )
+                )
+                
                 jobs_store[job_id]["model_results"]["gemini"]["progress"] = 10.0
                 logger.info(f"=== ANÁLISE GENÉRICA INICIADA ===")
                 logger.info(f"Documento: {os.path.basename(document_path)}")
                 
                 # NOVA: Análise completa (contexto + layout + estratégia)
                 logger.info("🔍 Iniciando análise de contexto...")  # ADICIONAR
-                context_description = await self.analyze_context(document_path)
+                context_description = await self.analyze_context(document_path, first_page_path)
                 logger.info("✅ Análise de contexto concluída")  # ADICIONAR
                 
                 context_info = self.current_context_info
                 
                 logger.info(f"Análise completa concluída:")
-                logger.info(f"- Layout: {self.current_layout_analysis.get('layout_type', 'UNKNOWN')}")
+                logger.info(f"- Layout: {self._layout_type}")
                 logger.info(f"- Estratégia: {self.current_strategy.name if self.current_strategy else 'N/A'}")
             else:
                 logger.info("📄 Documento não é PDF, usando configuração básica")  # ADICIONAR
@@ -850,8 +1125,7 @@ class GeminiExtractor(BaseExtractor):
             jobs_store[job_id]["model_results"]["gemini"]["progress"] = 15.0
             
             if is_pdf:
-                logger.info("📸 Convertendo PDF para imagens...")  # ADICIONAR
-                image_paths = convert_pdf_to_images(document_path, CONVERTED_DIR)
+                image_paths = first_page_paths + await conversion_task
                 logger.info(f"✅ {len(image_paths)} imagens criadas")  # ADICIONAR
             else:
                 image_paths = [document_path]
@@ -875,43 +1149,51 @@ class GeminiExtractor(BaseExtractor):
                 }
             
             progress_per_page = 80.0 / total_pages
-            
-            for page_num, img_path in enumerate(image_paths, start=1):
-                logger.info(f"📄 Processando página {page_num}/{total_pages}: {os.path.basename(img_path)}")  # ADICIONAR
-                
-                current_progress = 15.0 + (page_num - 1) * progress_per_page
-                jobs_store[job_id]["model_results"]["gemini"]["progress"] = current_progress
-                
-                # NOVA: Processamento com adaptação automática
-                logger.info(f"🔍 Enviando página {page_num} para análise IA...")  # ADICIONAR
-                page_result = await self.process_page(
-                    img_path,
-                    context_description,
-                    page_num,
-                    total_pages,
-                    combined_result if page_num > 1 else None
+            gemini_status = jobs_store[job_id]["model_results"]["gemini"]
+            pages_done = 0
+            
+            async def run_page(page_num: int, img_path: str, page_context: str) -> Dict[str, Any]:
+                nonlocal pages_done
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("📄 Processando página %d/%d: %s", page_num, total_pages, os.path.basename(img_path))  # ADICIONAR
+                page_result = await self._process_page_isolated(
+                    img_path, page_context, page_num, total_pages, combined_result
                 )
-                logger.info(f"✅ Página {page_num} processada")  # ADICIONAR
-                
-                # Verificar erro (mantém-se igual)
-                if "error" in page_result and not page_result.get("products"):
-                    logger.error(f"❌ Erro ao processar página {page_num}: {page_result['error']}")
-                    if page_num == 1:
-                        raise ValueError(f"Falha ao processar a primeira página: {page_result['error']}")
-                    continue
-                
-                # Mesclar resultados (mantém-se igual)
-                if "products" in page_result:
-                    products_found = len(page_result.get("products", []))
-                    logger.info(f"📦 Página {page_num}: {products_found} produtos encontrados")  # ADICIONAR
-                    combined_result["products"].extend(page_result.get("products", []))
+                pages_done += 1
+                gemini_status["progress"] = 15.0 + pages_done * progress_per_page
+                return page_result
+            
+            # Primeira página sequencial: serve de sonda para adaptar a estratégia
+            logger.info(f"📄 Processando página 1/{total_pages}: {os.path.basename(image_paths[0])}")  # ADICIONAR
+            logger.info("🔍 Enviando página 1 para análise IA...")  # ADICIONAR
+            first_page_result = await self.process_page(
+                image_paths[0],
+                context_description,
+                1,
+                total_pages,
+                None
+            )
+            logger.info("✅ Página 1 processada")  # ADICIONAR
+            self._merge_page_result(combined_result, first_page_result, 1)
+            pages_done = 1
+            gemini_status["progress"] = 15.0 + progress_per_page
+            
+            if total_pages > 1:
+                # Restantes páginas em paralelo com a estratégia adaptada após a primeira
+                page_context = self._adapt_strategy_for_page(context_description, 2)
+                logger.info(f"🔍 Enviando {total_pages - 1} páginas em paralelo para análise IA...")
                 
-                if "order_info" in page_result and page_result["order_info"]:
-                    for key, value in page_result["order_info"].items():
-                        if value and (key not in combined_result["order_info"] or not combined_result["order_info"].get(key)):
-                            combined_result["order_info"][key] = value
+                remaining_results = await asyncio.gather(
+                    *(run_page(page_num, img_path, page_context)
+                      for page_num, img_path in enumerate(image_paths[1:], start=2)),
+                    return_exceptions=True
+                )
                 
-                jobs_store[job_id]["model_results"]["gemini"]["progress"] = 15.0 + page_num * progress_per_page
+                for page_num, page_result in enumerate(remaining_results, start=2):
+                    if isinstance(page_result, Exception):
+                        page_result = {"error": str(page_result), "products": []}
+                    self.page_results_history.append(page_result)
+                    self._merge_page_result(combined_result, page_result, page_num)
             
             total_products = len(combined_result["products"])
             logger.info(f"🎉 EXTRAÇÃO CONCLUÍDA - Total de produtos: {total_products}")
@@ -927,8 +1209,8 @@ class GeminiExtractor(BaseExtractor):
                     combined_result["_ai_color_mapping"] = mapping_report
                     
                     stats = mapping_report['statistics']
-                    if stats['mappings_details']:
-                        for change in stats['mappings_details'][:3]:
+                    if stats['mappings_details'] and logger.isEnabledFor(logging.INFO):
+                        for change in islice(stats['mappings_details'], 3):
                             confidence = change.get('confidence', 'unknown')
                             logger.info(f"  '{change['original_name']}' ({change['original_code']}) → '{change['mapped_name']}' ({change['mapped_code']}) [confidence: {confidence}]")
                 
@@ -940,23 +1222,26 @@ class GeminiExtractor(BaseExtractor):
             logger.debug(f"🔍 Antes do pós-processamento: {len(combined_result['products'])} produtos")
             
             try:
-                result_tuple = self._post_process_products(combined_result["products"], context_info)
+                # Pós-processamento (incl. códigos de barras) fora do event loop
+                result_tuple = await asyncio.to_thread(
+                    self._post_process_products, combined_result["products"], context_info
+                )
                 
                 # Verificar se retornou tupla corretamente
-                if isinstance(result_tuple, tuple) and len(result_tuple) == 2:
-                    processed_products, determined_supplier = result_tuple
+                if isinstance(result_tuple, tuple) and len(result_tuple) == 3:
+                    processed_products, determined_supplier, markup = result_tuple
                     logger.debug(f"✅ Pós-processamento retornou: {len(processed_products) if processed_products else 0} produtos, fornecedor: {determined_supplier}")
                 else:
                     logger.error(f"❌ Retorno inesperado do pós-processamento: {type(result_tuple)}")
                     processed_products = []
                     determined_supplier = ""
+                    markup = self._supplier_markup(context_info.get("supplier", ""))
                     
             except Exception as e:
-                logger.error(f"❌ Erro no pós-processamento: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
+                logger.exception(f"❌ Erro no pós-processamento: {str(e)}")
                 processed_products = []
                 determined_supplier = context_info.get("supplier", "")
+                markup = self._supplier_markup(determined_supplier)
             
             combined_result["order_info"]["supplier"] = determined_supplier
             
@@ -971,17 +1256,8 @@ class GeminiExtractor(BaseExtractor):
                     logger.error("❌ Sem produtos para processar!")
             
             if has_json_utils and processed_products:
-                supplier = context_info.get("supplier", "")
-                supplier_code = get_supplier_code(supplier) if supplier else None
-                markup = 2.73
-                
-                if supplier_code:
-                    markup_value = get_markup(supplier_code)
-                    if markup_value:
-                        markup = markup_value
-                
                 produtos_antes_fix = len(processed_products)
-                processed_products = fix_nan_in_products(processed_products, markup=markup)
+                processed_products = await asyncio.to_thread(fix_nan_in_products, processed_products, markup=markup)
                 produtos_depois_fix = len(processed_products) if processed_products else 0
                 
                 logger.info(f"Produtos sanitizados para evitar valores NaN no JSON: {produtos_antes_fix} → {produtos_depois_fix}")
@@ -992,7 +1268,7 @@ class GeminiExtractor(BaseExtractor):
             processing_time = time.time() - start_time
             
             # NOVA: Metadados melhorados
-            strategy_adaptations = len(set(r.get("_strategy_used", "") for r in self.page_results_history)) - 1
+            strategy_adaptations = len(self._strategies_seen) - 1
             
             combined_result["_metadata"] = {
                 "pages_processed": total_pages,
@@ -1001,72 +1277,72 @@ class GeminiExtractor(BaseExtractor):
                 "processing_time_seconds": processing_time,
                 "context_info": context_info,
                 "layout_analysis": self.current_layout_analysis,
-                "final_strategy": self.current_strategy.name if self.current_strategy else "unknown",
+                "final_strategy": self._strategy_name,
                 "strategy_adaptations": strategy_adaptations,
                 "agents_used": ["ContextAgent", "LayoutDetectionAgent", "GenericStrategyAgent", "ExtractionAgent", "ColorMappingAgent"],
             }
             
             # Log final melhorado
-            logger.info(f"=== EXTRAÇÃO CONCLUÍDA ===")
-            logger.info(f"Produtos extraídos: {len(combined_result['products'])}")
-            logger.info(f"Tempo total: {processing_time:.2f}s")
-            logger.info(f"Layout detectado: {self.current_layout_analysis.get('layout_type', 'UNKNOWN')}")
-            logger.info(f"Estratégia final: {self.current_strategy.name if self.current_strategy else 'N/A'}")
-            logger.info(f"Adaptações: {strategy_adaptations}")
-            
-            # Atualizar job (mantém-se igual)
-            jobs_store[job_id]["model_results"]["gemini"] = {
-                "model_name": GEMINI_MODEL,
-                "status": "completed",
-                "progress": 100.0,
-                "result": combined_result,
-                "processing_time": processing_time
-            }
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    f"=== EXTRAÇÃO CONCLUÍDA ===\n"
+                    f"Produtos extraídos: {len(combined_result['products'])}\n"
+                    f"Tempo total: {processing_time:.2f}s\n"
+                    f"Layout detectado: {self._layout_type}\n"
+                    f"Estratégia final: {self.current_strategy.name if self.current_strategy else 'N/A'}\n"
+                    f"Adaptações: {strategy_adaptations}"
+                )
             
-            results_file = os.path.join(os.path.dirname(CONVERTED_DIR), "results", f"{job_id}_gemini.json")
+            results_file = os.path.join(RESULTS_DIR, f"{job_id}_gemini.json")
+            # Ficheiro consumido por máquina: compacto, exceto se pedido explicitamente
+            json_format = {"indent": 2} if PRETTY_RESULTS_JSON else {"indent": None, "separators": (',', ':')}
             if has_json_utils:
-                success = safe_json_dump(combined_result, results_file)
-                if success:
+                saved = safe_json_dump(combined_result, results_file, **json_format)
+                if saved:
                     logger.info(f"Resultado salvo com sucesso em: {results_file}")
                 else:
                     logger.error(f"Falha ao salvar resultado em: {results_file}")
             else:
+                saved = False
                 try:
-                    def sanitize_basic(obj):
-                        import math
-                        if isinstance(obj, dict):
-                            return {k: sanitize_basic(v) for k, v in obj.items()}
-                        elif isinstance(obj, list):
-                            return [sanitize_basic(item) for item in obj]
-                        elif isinstance(obj, float) and (math.isnan(obj) or math.isinf(obj)):
-                            return 0.0
-                        else:
-                            return obj
-                    
-                    sanitized_result = sanitize_basic(combined_result)
-                    
+                    # Só os dados vindos do modelo podem ter NaN: corrigidos no próprio objeto
+                    _sanitize_nan_in_place(combined_result["products"])
+                    _sanitize_nan_in_place(combined_result["order_info"])
                     with open(results_file, "w") as f:
-                        json.dump(sanitized_result, f, indent=2)
+                        json.dump(combined_result, f, **json_format)
+                    saved = True
                     logger.info(f"Resultado salvo com sanitização básica em: {results_file}")
                 except Exception as e:
                     logger.error(f"Erro ao salvar resultado: {str(e)}")
             
+            # Atualizar job: apenas metadados; o resultado completo é lido do disco quando pedido
+            final_status = {
+                "model_name": GEMINI_MODEL,
+                "status": "completed",
+                "progress": 100.0,
+                "product_count": len(combined_result["products"]),
+                "processing_time": processing_time
+            }
+            if saved:
+                final_status["result_path"] = results_file
+            else:
+                # Sem ficheiro no disco, manter o resultado em memória
+                final_status["result"] = combined_result
+            jobs_store[job_id]["model_results"]["gemini"] = final_status
+            
             update_progress_callback(job_id)
             
-            rocessing_time = time.time() - start_time
             logger.info(f"⏱️ Tempo total de processamento: {processing_time:.2f}s")  
             logger.info(f"📊 Taxa de produtos por segundo: {total_products/processing_time:.2f}")
             
-            needs_validation = False
-            for product in combined_result.get("products", []):
-                for color in product.get("colors", []):
-                    color_code = color.get("color_code", "")
-                    # Se tem código original (22222, X0707, etc.), precisa validação
-                    if color_code and len(color_code) > 3:
-                        needs_validation = True
-                        break
+            # Se alguma cor tem código original (22222, X0707, etc.), precisa validação
+            needs_validation = any(
+                len(color.get("color_code") or "") > 3
+                for product in combined_result.get("products", [])
+                for color in product.get("colors", [])
+            )
 
-            if needs_validation:
+            if needs_validation and HAS_VALIDATION:
                 logger.info("⚠️ Executando validação...")
                 validation_agent = ValidationAgent()
                 validated_result = validation_agent.validate_extraction_result(combined_result)
@@ -1092,16 +1368,25 @@ class GeminiExtractor(BaseExtractor):
             update_progress_callback(job_id)
             
             return {"error": error_message}
+        
+        finally:
+            # Conversão em segundo plano ainda pendente se algo falhou antes de a aguardar
+            if conversion_task is not None and not conversion_task.done():
+                # A thread não é interrompível: o evento pára-a na página seguinte
+                conversion_stop.set()
+                conversion_task.cancel()
     
-    def _post_process_products(self, products: List[Dict[str, Any]], context_info: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], str]:
+    def _post_process_products(self, products: List[Dict[str, Any]], context_info: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], str, float]:
 
         processed_products = []
-        seen_material_codes = set()
-        ref_counters = {}
+        products_by_code = {}
+        color_codes_by_code = {}
+        subtotal_sums_by_code = {}
         
         # ETAPA 1: DETERMINAR FORNECEDOR DO DOCUMENTO (APENAS UMA VEZ)
         supplier_name, supplier_code, markup = determine_best_supplier(context_info)
-        original_brand = context_info.get("brand", "")
+        supplier_name = _intern_str(supplier_name)
+        original_brand = _intern_str(context_info.get("brand", ""))
 
         # Log do resumo da determinação
         logger.info(f"Fornecedor determinado: '{supplier_name}' (código: {supplier_code}, markup: {markup})")
@@ -1112,63 +1397,61 @@ class GeminiExtractor(BaseExtractor):
         # ETAPA 2: PROCESSAR PRODUTOS (SEM LÓGICA DE FORNECEDOR INDIVIDUAL)
         for idx, product in enumerate(products):
             # DEBUG: Ver estrutura do produto
-            if idx == 0:  # Primeiro produto como exemplo
-                logger.debug(f"Exemplo de produto recebido: {json.dumps(product, indent=2, default=str)}")
+            if idx == 0 and logger.isEnabledFor(logging.DEBUG):  # Primeiro produto como exemplo
+                logger.debug("Exemplo de produto recebido: %s", json.dumps(product, indent=2, default=str))
             
             material_code = product.get("material_code")
             if not material_code:
-                logger.warning(f"Produto sem código de material ignorado: {product.get('name', 'sem nome')}")
+                logger.warning("Produto sem código de material ignorado: %s", product.get('name', 'sem nome'))
                 continue
             
-            # Limpeza do nome do produto
-            product_name = product.get("name", "")
-            if product_name is None: 
-                product_name = ""
-
-            pattern = r'^([A-Za-z\s]+)(?:\s+\d+.*)?$'
-            match = re.match(pattern, product_name)
+            # Limpeza do nome do produto (o ExtractionAgent garante sempre uma string)
+            product_name = product["name"]
 
-            if match:
-                clean_name = match.group(1).strip()
-                product["name"] = clean_name
+            if product_name.isascii() and product_name.isalpha():
+                # Só letras ASCII: a regex devolveria o próprio nome
+                clean_name = product_name
             else:
-                clean_name = re.sub(r'\d+', '', product_name).strip()
-                clean_name = re.sub(r'\s+', ' ', clean_name).strip()
-                product["name"] = clean_name
+                match = _NAME_RE.match(product_name)
 
-            if "name" in product:
-                product["name"] = product["name"].upper()
+                if match:
+                    clean_name = match.group(1).strip()
+                else:
+                    # Remover dígitos e normalizar espaços (split() também apara as pontas)
+                    clean_name = " ".join(product_name.translate(_DIGIT_TABLE).split())
+
+            name_upper = product["name"] = clean_name.upper()
 
-            if "brand" in product:
-                product["brand"] = product["brand"].upper()
+            product_brand = product.get("brand")
+            if product_brand is not None:
+                product_brand = product["brand"] = product_brand.upper()
+            product_brand = product_brand or original_brand
 
-            product_brand = product.get("brand", "") or original_brand
-            product["gender"] = determine_gender_by_brand(product_brand)
+            gender = product["gender"] = determine_gender_by_brand(product_brand)
 
-            if product["gender"] == "MULHER":
-                logger.info(f"Produto '{product['name']}' da marca '{product_brand}' definido como MULHER")
+            if gender == "MULHER":
+                logger.info("Produto '%s' da marca '%s' definido como MULHER", name_upper, product_brand)
 
-            has_valid_data = False
             has_basic_info = bool(material_code and product_name)
+            colors = product.get("colors")
             
-            # Verificar se tem estrutura de cores válida
-            if "colors" in product and isinstance(product.get("colors"), list) and len(product.get("colors")) > 0:
-                for color in product["colors"]:
-                    if isinstance(color, dict):
-                        # Verificar se tem tamanhos OU se tem informações básicas da cor
-                        if ("sizes" in color and isinstance(color.get("sizes"), list) and len(color.get("sizes")) > 0) or \
-                        (color.get("color_code") or color.get("color_name")):
-                            has_valid_data = True
-                            break
+            # Verificar se tem estrutura de cores válida (tamanhos OU informações básicas da cor)
+            has_valid_data = isinstance(colors, list) and any(
+                isinstance(color, dict) and (
+                    (isinstance(color.get("sizes"), list) and color["sizes"])
+                    or color.get("color_code") or color.get("color_name")
+                )
+                for color in colors
+            )
             
             # ALTERNATIVA: Produto pode ter estrutura diferente (sem array de cores)
             # Verificar se tem informações de produto válidas mesmo sem estrutura de cores
             if not has_valid_data and has_basic_info:
                 # Tentar criar estrutura de cores se não existir
-                if "colors" not in product or not product["colors"]:
+                if not colors:
                     # Verificar se há informações de cor/tamanho no nível do produto
                     if any(key in product for key in ["color_code", "color_name", "sizes", "quantity"]):
-                        logger.info(f"🔧 Produto {material_code}: Criando estrutura de cores")
+                        logger.info("🔧 Produto %s: Criando estrutura de cores", material_code)
                         # Criar estrutura de cor única
                         color_entry = {
                             "color_code": product.get("color_code", "000"),
@@ -1186,11 +1469,11 @@ class GeminiExtractor(BaseExtractor):
                                 "quantity": product.get("quantity", 0)
                             }]
                         
-                        product["colors"] = [color_entry]
+                        colors = product["colors"] = [color_entry]
                         has_valid_data = True
             
             # DEBUG: Log do status de validação
-            logger.debug(f"Produto {material_code}: has_valid_data={has_valid_data}, has_basic_info={has_basic_info}")
+            logger.debug("Produto %s: has_valid_data=%s, has_basic_info=%s", material_code, has_valid_data, has_basic_info)
             
             if has_valid_data or has_basic_info:
                 # NORMALIZAÇÃO DE CATEGORIA
@@ -1198,147 +1481,139 @@ class GeminiExtractor(BaseExtractor):
                 category_upper = original_category.upper() if original_category else ""
                 
                 # Garantir categoria consistente
-                if any(term in category_upper for term in ['POLO', 'POLOSHIRT']):
-                    normalized_category = "POLOS"
-                elif any(term in category_upper for term in ['SWEATER', 'SWEAT', 'MALHA', 'JERSEY']):
-                    normalized_category = "MALHAS"
-                else:
-                    # Para outras categorias, procurar correspondência em CATEGORIES
-                    normalized_category = None
-                    for category in CATEGORIES:
-                        if category in category_upper or category_upper in category:
-                            normalized_category = category
-                            break
-                    
-                    # Se não encontrar, usar "ACESSÓRIOS" como fallback
-                    if not normalized_category:
-                        normalized_category = "ACESSÓRIOS"
+                normalized_category = _normalize_category(category_upper)
                 
                 # Atualizar a categoria do produto
                 product["category"] = normalized_category
                 
                 # Logging para debug
                 if original_category != normalized_category:
-                    logger.debug(f"Categoria normalizada: '{original_category}' → '{normalized_category}' para produto '{product['name']}'")
+                    logger.debug("Categoria normalizada: '%s' → '%s' para produto '%s'", original_category, normalized_category, name_upper)
                 
                 # Verificar se já processamos este produto (pelo código de material)
-                if material_code in seen_material_codes:
+                existing_product = products_by_code.get(material_code)
+                if existing_product is not None:
                     # Mesclar com produto existente
-                    for existing_product in processed_products:
-                        if existing_product.get("material_code") == material_code:
-                            # Mesclar cores não duplicadas
-                            existing_color_codes = {c.get("color_code") for c in existing_product.get("colors", [])}
-                            
-                            for color in product.get("colors", []):
-                                color_code = color.get("color_code")
-                                if color_code and color_code not in existing_color_codes:
-                                    # Adicionar cor ainda não existente
-                                    existing_product["colors"].append(color)
-                                    existing_color_codes.add(color_code)
-                            
-                            # Recalcular total_price
-                            subtotals = [color.get("subtotal", 0) for color in existing_product["colors"] 
-                                        if color.get("subtotal") is not None]
-                            existing_product["total_price"] = sum(subtotals) if subtotals else None
-                            
-                            logger.debug(f"Produto {material_code} mesclado com existente")
-                            break
+                    existing_color_codes = color_codes_by_code[material_code]
+                    added_colors = []
+                    
+                    for color in colors or ():
+                        color_code = color.get("color_code")
+                        if color_code and color_code not in existing_color_codes:
+                            # Adicionar cor ainda não existente
+                            existing_product["colors"].append(color)
+                            existing_color_codes.add(color_code)
+                            added_colors.append(color)
+                    
+                    # Atualizar total_price: soma completa na primeira fusão, depois só as cores novas
+                    subtotal_sum = subtotal_sums_by_code.get(material_code)
+                    if subtotal_sum is None:
+                        subtotal_sum = subtotal_sums_by_code[material_code] = [0, 0]
+                        added_colors = existing_product["colors"]
+                    
+                    for color in added_colors:
+                        subtotal = color.get("subtotal")
+                        if subtotal is not None:
+                            subtotal_sum[0] += subtotal
+                            subtotal_sum[1] += 1
+                    
+                    existing_product["total_price"] = subtotal_sum[0] if subtotal_sum[1] else None
+                    
+                    logger.debug("Produto %s mesclado com existente", material_code)
                 else:
                     # Novo produto, adicionar à lista de processados
-                    seen_material_codes.add(material_code)
+                    products_by_code[material_code] = product
                     
-                    # Inicializar contador para este código de material
-                    if material_code not in ref_counters:
-                        ref_counters[material_code] = 0
+                    # Contador de referências (código de material ainda não visto: começa em 0)
+                    counter = 0
                     
                     # Adicionar campo de referências para cada cor e tamanho
                     product_references = []
+                    append_reference = product_references.append
+                    
+                    if colors is None:
+                        colors = product.setdefault("colors", [])
                     
-                    for color in product.get("colors", []):
-                        color_code = color.get("color_code", "")
-                        color_name = color.get("color_name", "")
+                    for color in colors:
+                        color_code = _intern_str(color.get("color_code", ""))
+                        color_name = _intern_str(color.get("color_name", ""))
                         
                         for size_info in color.get("sizes", []):
-                            size = size_info.get("size", "")
+                            size = _intern_str(size_info.get("size", ""))
                             quantity = size_info.get("quantity", 0)
                             
                             if quantity <= 0:
                                 continue
                             
                             # Incrementar contador para este material
-                            ref_counters[material_code] += 1
-                            counter = ref_counters[material_code]
+                            counter += 1
                             
                             # Criar referência completa
                             reference = f"{material_code}.{counter}"
                             
                             # Criar descrição formatada
-                            description = f"{product['name']}[{color_code}/{size}]"
+                            description = f"{name_upper}[{color_code}/{size}]"
                             
                             # Adicionar referência à lista
-                            product_references.append({
+                            append_reference({
                                 "reference": reference,
                                 "counter": counter,
                                 "color_code": color_code,
                                 "color_name": color_name,
                                 "size": size,
                                 "quantity": quantity,
-                                "description": description
+                                "description": description,
+                                "supplier": supplier_name
                             })
                     
                     product["references"] = product_references
+                    color_codes_by_code[material_code] = {c.get("color_code") for c in colors}
                     processed_products.append(product)
-                    logger.debug(f"✅ Produto {material_code} adicionado aos processados")
+                    logger.debug("✅ Produto %s adicionado aos processados", material_code)
             else:
-                logger.warning(f"❌ Produto {material_code} ignorado - sem dados válidos")
+                logger.warning("❌ Produto %s ignorado - sem dados válidos", material_code)
         
         # LOG CRÍTICO: Quantos produtos foram processados
         logger.info(f"📊 Pós-processamento concluído: {len(processed_products)} de {len(products)} produtos válidos")
         
-        # ETAPA 3: ATRIBUIR FORNECEDOR A TODOS OS PRODUTOS (APENAS UMA VEZ)
+        # ETAPA 3: ATRIBUIR FORNECEDOR, MARCA E PREÇOS NUMA ÚNICA PASSAGEM
         logger.debug(f"📦 Antes de atribuir fornecedor: {len(processed_products)} produtos")
         
         if processed_products:  # Só se houver produtos
-            # DEBUG: Verificar se assign_supplier_to_products está funcionando
-            produtos_antes = len(processed_products)
-            processed_products = assign_supplier_to_products(processed_products, supplier_name, markup)
-            produtos_depois = len(processed_products) if processed_products else 0
+            logger.info(f"Atribuindo fornecedor '{supplier_name}' a {len(processed_products)} produtos")
             
-            logger.debug(f"📦 Após assign_supplier_to_products: {produtos_antes} → {produtos_depois} produtos")
+            # Preservar marca original se existir (invariante do documento)
+            preserve_brand = bool(original_brand) and original_brand not in _BRAND_SENTINELS
             
-            # Verificar se processed_products ainda existe e não é None
-            if not processed_products:
-                logger.error("❌ assign_supplier_to_products retornou None ou lista vazia!")
-                processed_products = []
-            else:
-                # ETAPA 3.5: GARANTIR QUE TODOS OS CAMPOS ESTÃO CORRETOS
-                for product in processed_products:
-                    # Preservar marca original se existir
-                    if original_brand and original_brand not in ["", "Marca não identificada"]:
-                        product["brand"] = original_brand
-                    
-                    # Forçar o fornecedor normalizado
+            for product in processed_products:
+                # Forçar o fornecedor normalizado (sem reescrever valores já corretos)
+                if product.get("supplier") != supplier_name:
                     product["supplier"] = supplier_name
-                    
-                    # Garantir que cores têm fornecedor correto
-                    for color in product.get("colors", []):
+                
+                if preserve_brand:
+                    product["brand"] = original_brand
+                
+                # Garantir que cores têm fornecedor e preços corretos
+                for color in product["colors"]:
+                    if color.get("supplier") != supplier_name:
                         color["supplier"] = supplier_name
                     
-                    # CRÍTICO: Garantir que referências têm fornecedor correto
-                    for reference in product.get("references", []):
-                        reference["supplier"] = supplier_name
+                    if not color.get("sales_price") and color.get("unit_price"):
+                        color["sales_price"] = round(color.get("unit_price", 0) * markup, 2)
+                    
+                    if color.get("unit_price") and color.get("sizes"):
+                        total_quantity = sum(size.get("quantity", 0) for size in color["sizes"])
+                        if not color.get("subtotal") and total_quantity > 0:
+                            color["subtotal"] = round(color["unit_price"] * total_quantity, 2)
 
-                # ETAPA 4: FINALIZAR
-                processed_products.sort(key=lambda p: p.get("material_code", ""))
-                
-                try:
-                    from app.utils.barcode_generator import add_barcodes_to_products
-                    produtos_antes_barcode = len(processed_products)
-                    processed_products = add_barcodes_to_products(processed_products)
-                    produtos_depois_barcode = len(processed_products) if processed_products else 0
-                    logger.debug(f"📦 Após add_barcodes_to_products: {produtos_antes_barcode} → {produtos_depois_barcode} produtos")
-                except ImportError:
-                    logger.warning("Módulo barcode_generator não encontrado, pulando geração de códigos de barras")
+            # ETAPA 4: FINALIZAR
+            processed_products.sort(key=itemgetter("material_code"))
+            
+            if add_barcodes_to_products is not None:
+                produtos_antes_barcode = len(processed_products)
+                processed_products = add_barcodes_to_products(processed_products)
+                produtos_depois_barcode = len(processed_products) if processed_products else 0
+                logger.debug(f"📦 Após add_barcodes_to_products: {produtos_antes_barcode} → {produtos_depois_barcode} produtos")
         
         # LOG FINAL ANTES DE RETORNAR
         logger.info(f"📊 Retornando {len(processed_products)} produtos processados")
@@ -1352,7 +1627,7 @@ class GeminiExtractor(BaseExtractor):
         
         logger.info(f"📊 Qualidade dos tamanhos: {quality_report['quality_score']:.1%}")
 
-        return processed_products, supplier_name
+        return processed_products, supplier_name, markup
 
     def _check_size_quality(self, products: List[Dict]) -> Dict[str, Any]:
         """
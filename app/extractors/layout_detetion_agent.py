@@ -1,5 +1,6 @@
 # app/extractors/layout_detetion_agent.py
 import os
+import asyncio
 import json
 import logging
 import re
@@ -10,7 +11,7 @@ from PIL import Image
 import fitz
 
 from app.config import GEMINI_API_KEY, GEMINI_MODEL
-from app.utils.file_utils import convert_pdf_to_images, optimize_image
+from app.utils.file_utils import MUPDF_LOCK, convert_pdf_to_images, optimize_image
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +21,11 @@ class LayoutDetetionAgent:
         genai.configure(api_key=self.api_key)
         self.model = genai.GenerativeModel(GEMINI_MODEL)
     
-    async def analyze_document_structure(self, document_path: str) -> Dict[str, Any]:
+    async def analyze_document_structure(self, document_path: str, first_page_path: Optional[str] = None) -> Dict[str, Any]:
         try:
             technical_analysis = self._analyze_pdf_technical_structure(document_path)
             
-            visual_analysis = await self._analyze_visual_patterns(document_path)
+            visual_analysis = await self._analyze_visual_patterns(document_path, first_page_path)
             
             content_analysis = self._analyze_text_patterns(document_path)
             
@@ -52,11 +53,12 @@ class LayoutDetetionAgent:
                 "table_indicators": []
             }
             
-            pdf_document = fitz.open(pdf_path)
+            with MUPDF_LOCK:
+                pdf_document = fitz.open(pdf_path)
             
-            # Analisar primeira página em detalhe
-            page = pdf_document.load_page(0)
-            blocks = page.get_text("dict")
+                # Analisar primeira página em detalhe
+                page = pdf_document.load_page(0)
+                blocks = page.get_text("dict")
             
             # Extrair coordenadas de todo o texto
             all_coordinates = []
@@ -363,20 +365,26 @@ class LayoutDetetionAgent:
         
         return indicators
     
-    async def _analyze_visual_patterns(self, document_path: str) -> Dict[str, Any]:
+    async def _analyze_visual_patterns(self, document_path: str, first_page_path: Optional[str] = None) -> Dict[str, Any]:
         """
         Análise visual usando IA - completamente genérica
         """
         try:
-            # Converter primeira página para imagem
-            image_paths = convert_pdf_to_images(document_path, os.path.dirname(document_path), pages=[0])
-            
-            if not image_paths:
-                return {"error": "Não foi possível converter para imagem"}
-            
-            # Otimizar imagem
-            optimized_path = optimize_image(image_paths[0], os.path.dirname(image_paths[0]))
-            image = Image.open(optimized_path)
+            if first_page_path:
+                # Primeira página já renderizada e otimizada pelo chamador
+                image = Image.open(first_page_path)
+            else:
+                # Converter primeira página para imagem
+                image_paths = await asyncio.to_thread(
+                    convert_pdf_to_images, document_path, os.path.dirname(document_path), pages=[0]
+                )
+                
+                if not image_paths:
+                    return {"error": "Não foi possível converter para imagem"}
+                
+                # Otimizar imagem
+                optimized_path = optimize_image(image_paths[0], os.path.dirname(image_paths[0]))
+                image = Image.open(optimized_path)
             
             # Prompt genérico para análise visual
             visual_prompt = """
@@ -457,7 +465,7 @@ class LayoutDetetionAgent:
             """
             
             # Gerar análise visual
-            response = self.model.generate_content([visual_prompt, image])
+            response = await self.model.generate_content_async([visual_prompt, image])
             
             # Extrair JSON da resposta
             visual_analysis = self._extract_json_from_text(response.text)
@@ -473,13 +481,14 @@ class LayoutDetetionAgent:
         Análise de padrões no texto extraído
         """
         try:
-            pdf_document = fitz.open(pdf_path)
-            full_text = ""
-            
-            # Extrair texto de até 3 páginas
-            for page_num in range(min(3, len(pdf_document))):
-                page = pdf_document.load_page(page_num)
-                full_text += page.get_text()
+            with MUPDF_LOCK:
+                pdf_document = fitz.open(pdf_path)
+                full_text = ""
+            
+                # Extrair texto de até 3 páginas
+                for page_num in range(min(3, len(pdf_document))):
+                    page = pdf_document.load_page(page_num)
+                    full_text += page.get_text()
             
             analysis = {
                 "product_indicators": self._detect_product_patterns(full_text),
@@ -21,7 +21,7 @@ from app.config import (
 )
 
 from app.models.schemas import JobStatus
-from app.services.job_service import JobService
+from app.services.job_service import JobService, load_model_result
 from app.services.cleanup_service import init_cleanup_service, get_cleanup_service
 from app.services.document_service import DocumentService
 from app.extractors.gemini_extractor import GeminiExtractor
@@ -454,11 +454,25 @@ async def get_job_status(job_id: str):
     if job["status"] == "completed":
         # Extrair informações do resultado
         if "model_results" in job and "gemini" in job["model_results"]:
-            result = job["model_results"]["gemini"].get("result", {})
-            products_count = len(result.get("products", []))
+            gemini_result = job["model_results"]["gemini"]
+            if "product_count" in gemini_result:
+                products_count = gemini_result["product_count"]
+            else:
+                products_count = len(gemini_result.get("result", {}).get("products", []))
             processing_time = job["model_results"]["gemini"].get("processing_time", 0)
             
             metrics.record_request_success(job_id, processing_time, products_count)
+            
+            # Resultado guardado em disco: incluí-lo na resposta, como antes
+            if "result" not in gemini_result and "result_path" in gemini_result:
+                try:
+                    result = load_model_result(gemini_result)
+                except FileNotFoundError:
+                    raise HTTPException(status_code=410, detail="Resultado do job já não está disponível")
+                job = {
+                    **job,
+                    "model_results": {**job["model_results"], "gemini": {**gemini_result, "result": result}}
+                }
     elif job["status"] == "failed":
         metrics.record_request_failure(job_id, "job_failed")
     
@@ -480,13 +494,17 @@ async def get_job_excel(job_id: str, season: str = None):
         raise HTTPException(status_code=400, detail="Job ainda em processamento")
     
     # Verificar se temos resultados
-    if "gemini" not in job["model_results"] or "result" not in job["model_results"]["gemini"]:
+    gemini_result = job["model_results"].get("gemini", {})
+    if "result" not in gemini_result and "result_path" not in gemini_result:
         raise HTTPException(status_code=404, detail="Resultados não disponíveis")
     
     try:
         # Extrair dados do resultado
-        extraction_result = job["model_results"]["gemini"]["result"]
-        
+        extraction_result = load_model_result(gemini_result)
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Resultados já não estão disponíveis")
+    
+    try:
         # Criar DataFrame
         df = create_dataframe_from_extraction(extraction_result, season)
         
@@ -537,9 +555,13 @@ async def get_job_json(job_id: str):
     # PASSO 3: Se encontrou job em memória, tentar extrair resultado
     if job and job.get("status") == "completed":
         model_results = job.get("model_results", {})
-        if "gemini" in model_results and "result" in model_results["gemini"]:
+        gemini_result = model_results.get("gemini", {})
+        if "result" in gemini_result or "result_path" in gemini_result:
+            try:
+                extraction_result = load_model_result(gemini_result)
+            except FileNotFoundError:
+                raise HTTPException(status_code=410, detail="Resultado do job já não está disponível")
             try:
-                extraction_result = model_results["gemini"]["result"]
                 logger.info(f"✅ Resultado extraído da memória para: {job_id_found}")
                 logger.info(f"📊 Produtos encontrados: {len(extraction_result.get('products', []))}")
                 return JSONResponse(content=extraction_result, status_code=200)
@@ -549,7 +571,7 @@ async def get_job_json(job_id: str):
     # PASSO 4: FALLBACK - Buscar arquivo JSON diretamente
     logger.info(f"🔍 Buscando arquivo JSON para: {job_id}")
     
-    results_dir = os.path.join(os.path.dirname(CONVERTED_DIR), "results")
+    results_dir = RESULTS_DIR
     
     # Criar variações de nomes de arquivo baseadas nas variações do job_id
     filename_variants = []
@@ -3,13 +3,54 @@ import os
 import json
 import logging
 import uuid
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 from app.extractors.base import BaseExtractor
+from app.utils.json_utils import load_json_file
 
 logger = logging.getLogger(__name__)
 
+# Resultados lidos do disco por (caminho, mtime): evita reler o ficheiro a cada consulta do job
+_RESULT_CACHE: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+_RESULT_CACHE_SIZE = 8
+
+
+def load_model_result(model_result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Obtém o resultado completo de um modelo, lendo do disco quando necessário
+
+    Args:
+        model_result: Entrada do modelo em job["model_results"]
+
+    Returns:
+        Dict: Resultado da extração (partilhado entre chamadas; não deve ser alterado)
+
+    Raises:
+        FileNotFoundError: Se o ficheiro de resultado já não existir (ex. removido pela limpeza)
+    """
+    if "result" in model_result:
+        return model_result["result"]
+
+    result_path = model_result.get("result_path")
+    if not result_path:
+        raise FileNotFoundError("Resultado indisponível: sem ficheiro associado")
+
+    # os.stat lança FileNotFoundError se o ficheiro foi removido
+    cache_key = (result_path, os.stat(result_path).st_mtime_ns)
+    cached = _RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        _RESULT_CACHE.move_to_end(cache_key)
+        return cached
+
+    result = load_json_file(result_path)
+    _RESULT_CACHE[cache_key] = result
+    if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+        _RESULT_CACHE.popitem(last=False)
+    return result
+
+
 class JobService:
     """Serviço para gerenciamento de jobs de processamento"""
     
@@ -6,6 +6,8 @@ import pandas as pd
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from app.services.job_service import load_model_result
+
 logger = logging.getLogger(__name__)
 
 class ReferenceService:
@@ -199,7 +201,7 @@ class ReferenceService:
         """
         # Extrair o resultado do modelo Gemini do job completo
         if "model_results" in job_result and "gemini" in job_result["model_results"]:
-            extraction_result = job_result["model_results"]["gemini"].get("result", {})
+            extraction_result = load_model_result(job_result["model_results"]["gemini"])
         else:
             extraction_result = job_result  # Assumir que o próprio input já é o extraction_result
         
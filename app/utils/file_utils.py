@@ -2,12 +2,23 @@
 import os
 import fitz  # PyMuPDF
 import logging
+import threading
 from PIL import Image
 from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
-def convert_pdf_to_images(pdf_path: str, output_dir: str, dpi: int = 150, pages: Optional[List[int]] = None) -> List[str]:
+# O PyMuPDF não é thread-safe: as conversões (executadas fora do event loop)
+# e as leituras feitas pelos agentes no event loop são serializadas por este lock
+MUPDF_LOCK = threading.Lock()
+
+def convert_pdf_to_images(
+    pdf_path: str,
+    output_dir: str,
+    dpi: int = 150,
+    pages: Optional[List[int]] = None,
+    stop_event: Optional[threading.Event] = None
+) -> List[str]:
     """
     Converte um PDF em imagens, uma por página.
     
@@ -16,52 +27,126 @@ def convert_pdf_to_images(pdf_path: str, output_dir: str, dpi: int = 150, pages:
         output_dir: Diretório onde as imagens serão salvas
         dpi: Resolução das imagens em DPI
         pages: Lista opcional de índices de páginas a converter (0-indexed). Se None, converte todas.
+        stop_event: Evento opcional; quando ativado, a conversão pára antes da página seguinte
     
     Returns:
         List[str]: Lista de caminhos para as imagens geradas
     """
     try:
-        # Abrir o documento PDF
-        pdf_document = fitz.open(pdf_path)
+        with MUPDF_LOCK:
+            # Abrir o documento PDF
+            pdf_document = fitz.open(pdf_path)
+            page_count = len(pdf_document)
         
         image_paths = []
         
         # Determinar quais páginas converter
         if pages is None:
-            page_indices = range(len(pdf_document))
+            page_indices = range(page_count)
         else:
-            page_indices = [p for p in pages if 0 <= p < len(pdf_document)]
+            page_indices = [p for p in pages if 0 <= p < page_count]
+        
+        # Ajustar zoom com base no DPI (2.0 = 192 DPI, 1.5 = 144 DPI)
+        zoom_factor = dpi / 96  # 96 DPI é o padrão
         
         # Iterar por cada página
         for page_idx in page_indices:
-            page = pdf_document.load_page(page_idx)
-            
-            # Ajustar zoom com base no DPI (2.0 = 192 DPI, 1.5 = 144 DPI)
-            zoom_factor = dpi / 96  # 96 DPI é o padrão
+            if stop_event is not None and stop_event.is_set():
+                logger.info(f"Conversão de {os.path.basename(pdf_path)} interrompida na página {page_idx+1}")
+                break
             
-            # Renderizar página como imagem com zoom
-            pix = page.get_pixmap(matrix=fitz.Matrix(zoom_factor, zoom_factor))
-            
-            # Salvar imagem
             output_path = os.path.join(output_dir, f"{os.path.basename(pdf_path)}_page_{page_idx+1}.png")
-            pix.save(output_path)
-            image_paths.append(output_path)
             
+            # Lock por página: outros leitores do PDF esperam no máximo uma renderização
+            with MUPDF_LOCK:
+                page = pdf_document.load_page(page_idx)
+                
+                # Renderizar página como imagem com zoom
+                pix = page.get_pixmap(matrix=fitz.Matrix(zoom_factor, zoom_factor))
+                
+                # Salvar imagem
+                pix.save(output_path)
+            image_paths.append(output_path)
+        
         return image_paths
     
     except Exception as e:
         logger.error(f"Erro ao converter PDF para imagens: {str(e)}")
         raise
 
+def rasterize_pdf_in_memory(
+    pdf_path: str,
+    dpi: int = 150,
+    pages: Optional[List[int]] = None,
+    max_dimension: Optional[int] = None
+) -> List[Image.Image]:
+    """
+    Converte um PDF em imagens PIL em memória, sem gravar PNGs em disco.
+    
+    Args:
+        pdf_path: Caminho para o arquivo PDF
+        dpi: Resolução das imagens em DPI (mesma escala de convert_pdf_to_images)
+        pages: Lista opcional de índices de páginas a converter (0-indexed). Se None, converte todas.
+        max_dimension: Lado máximo opcional em pixels; páginas maiores são renderizadas já reduzidas
+    
+    Returns:
+        List[Image.Image]: Lista de imagens RGB, uma por página
+    """
+    try:
+        with MUPDF_LOCK:
+            pdf_document = fitz.open(pdf_path)
+            page_count = len(pdf_document)
+        
+        try:
+            if pages is None:
+                page_indices = range(page_count)
+            else:
+                page_indices = [p for p in pages if 0 <= p < page_count]
+            
+            zoom_factor = dpi / 96  # 96 DPI é o padrão
+            matrix = fitz.Matrix(zoom_factor, zoom_factor)
+            
+            images = []
+            for page_idx in page_indices:
+                # Lock por página, como em convert_pdf_to_images: o event loop espera no máximo uma página
+                with MUPDF_LOCK:
+                    page = pdf_document.load_page(page_idx)
+                    page_matrix = matrix
+                    if max_dimension:
+                        long_edge = max(page.rect.width, page.rect.height) * zoom_factor
+                        if long_edge > max_dimension:
+                            # Reduzir na renderização em vez de redimensionar a imagem depois
+                            scale = zoom_factor * max_dimension / long_edge
+                            page_matrix = fitz.Matrix(scale, scale)
+                    pix = page.get_pixmap(matrix=page_matrix, alpha=False)
+                    samples = pix.samples
+                images.append(Image.frombytes("RGB", (pix.width, pix.height), samples))
+            
+            return images
+        finally:
+            with MUPDF_LOCK:
+                pdf_document.close()
+    
+    except Exception as e:
+        logger.error(f"Erro ao converter PDF para imagens em memória: {str(e)}")
+        raise
+
+def get_pdf_page_count(pdf_path: str) -> int:
+    """Devolve o número de páginas de um PDF."""
+    with MUPDF_LOCK:
+        with fitz.open(pdf_path) as pdf_document:
+            return len(pdf_document)
+
 def extract_text_from_pdf(pdf_path: str) -> str:
     """Extrai texto de um arquivo PDF."""
     try:
-        pdf_document = fitz.open(pdf_path)
-        text = ""
-        
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            text += page.get_text()
+        with MUPDF_LOCK:
+            pdf_document = fitz.open(pdf_path)
+            text = ""
+            
+            for page_num in range(len(pdf_document)):
+                page = pdf_document.load_page(page_num)
+                text += page.get_text()
             
         return text
     except Exception as e:
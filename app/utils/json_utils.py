@@ -6,6 +6,12 @@ from typing import Any, Dict, List, Optional, Union, Tuple
 
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 def is_json_serializable(obj: Any) -> bool:
     """
     Verifica se um objeto é serializável para JSON
@@ -41,9 +47,8 @@ def sanitize_for_json(
         return obj
     
     if isinstance(obj, str):
-        if not obj or not is_json_serializable(obj):
-            return default_str
-        return obj
+        # Strings são sempre serializáveis; apenas a string vazia é substituída
+        return obj or default_str
     
     if isinstance(obj, dict):
         return {
@@ -78,6 +83,18 @@ def sanitize_for_json(
         logger.warning(f"Objeto não serializável do tipo {type(obj)} substituído por None")
         return None
 
+def _orjson_option(kwargs: Dict[str, Any]) -> Optional[int]:
+    """
+    Devolve as opções orjson equivalentes aos kwargs de json.dump, ou None se não houver equivalente
+    """
+    if not HAS_ORJSON:
+        return None
+    if kwargs == {'indent': 2, 'ensure_ascii': False}:
+        return orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+    if kwargs == {'indent': None, 'ensure_ascii': False, 'separators': (',', ':')}:
+        return orjson.OPT_NON_STR_KEYS
+    return None
+
 def safe_json_dump(obj: Any, file_path: str, **kwargs) -> bool:
     """
     Salva um objeto como JSON de forma segura, garantindo sanitização prévia
@@ -90,6 +107,13 @@ def safe_json_dump(obj: Any, file_path: str, **kwargs) -> bool:
         if 'ensure_ascii' not in kwargs:
             kwargs['ensure_ascii'] = False
         
+        # orjson cobre os formatos usados (indentação 2 ou compacto, UTF-8 sem escapes)
+        orjson_option = _orjson_option(kwargs)
+        if orjson_option is not None:
+            with open(file_path, 'wb') as f:
+                f.write(orjson.dumps(sanitized_obj, option=orjson_option))
+            return True
+        
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(sanitized_obj, f, **kwargs)
         
@@ -109,6 +133,21 @@ def safe_json_dump(obj: Any, file_path: str, **kwargs) -> bool:
             logger.error(f"Falha na recuperação: {str(e2)}")
             return False
 
+def load_json_file(file_path: str) -> Any:
+    """
+    Lê um ficheiro JSON, com orjson quando disponível (recorre ao json para NaN/Infinity)
+    """
+    if HAS_ORJSON:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return json.loads(data)
+    
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def fix_nan_in_products(products: List[Dict[str, Any]], markup: float = 2.73) -> List[Dict[str, Any]]:
 
     if not products: